@@ -0,0 +1,364 @@
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+parser = argparse.ArgumentParser(
+    description="benchmark the smali/xml helpers on a synthetic decompiled tree, "
+    "run from the repo root with `python -m benchmarks.run`"
+)
+parser.add_argument("--files", help="number of smali files", type=int, default=400)
+parser.add_argument("--methods", help="methods per smali file", type=int, default=20)
+parser.add_argument("--lines", help="instructions per method", type=int, default=30)
+parser.add_argument("--colors", help="colors per values folder", type=int, default=2000)
+parser.add_argument("--patches", help="patches in the synthetic repo manifest", type=int, default=500)
+parser.add_argument("--repeat", help="timed runs per case, the fastest one counts", type=int, default=5)
+parser.add_argument("--min-time", help="seconds each timed run lasts at least, short cases loop", type=float, default=0.1)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--only", help="run only cases whose name contains this", type=str, default=None)
+parser.add_argument("--baseline", help="baseline json file", type=str, default=BASELINE)
+parser.add_argument("--save-baseline", help="store the results as the new baseline", action="store_true")
+parser.add_argument("--threshold", help="allowed slowdown against the baseline, 0.25 = 25%%", type=float, default=0.25)
+parser.add_argument("--noise-floor", help="slowdowns of fewer seconds per call never count", type=float, default=0.001)
+bench_args = parser.parse_args()
+
+# config parses the command line the first time it is used
+sys.argv = sys.argv[:1]
+from config import config
+from scripts.registry import RepositoryRegistry
+from scripts.resources import ResourceTable
+from scripts.repository import load_manifest
+from scripts.smali_parser import (
+    SmaliDocument,
+    find_and_replace_smali_lines,
+    get_smali_lines,
+    list_smali_files,
+    search_smali,
+)
+from scripts.utils import (
+    change_attributes,
+    change_attributes_all,
+    change_attributes_all_with_value,
+    change_attributes_with_value,
+    change_colors,
+    XmlEditSession,
+)
+
+
+def generate_smali(rng: random.Random, index: int, methods: int, lines: int) -> str:
+    out = [
+        f".class public Lcom/bench/pkg{index % 16}/Class{index};",
+        ".super Ljava/lang/Object;",
+        '.source "Bench.java"',
+        "",
+        ".field private static final TAG:Ljava/lang/String; = \"Bench\"",
+        ".field private count:I",
+        "",
+    ]
+    for method in range(methods):
+        out += [
+            f".method public method{method}(ILjava/lang/String;)Z",
+            "    .locals 4",
+            "",
+        ]
+        for line in range(lines):
+            kind = rng.randrange(4)
+            if kind == 0:
+                out.append(f'    const-string v0, "string_{index}_{method}_{line}"')
+            elif kind == 1:
+                out.append(
+                    f"    invoke-virtual {{p0, v0}}, Lcom/bench/pkg{rng.randrange(16)}/"
+                    f"Class{rng.randrange(index + 1)};->method{rng.randrange(methods)}(ILjava/lang/String;)Z"
+                )
+            elif kind == 2:
+                out.append(f"    :cond_{line}")
+            else:
+                out.append(f"    const/4 v{rng.randrange(4)}, 0x{rng.randrange(8):x}")
+            out.append("")
+        out += ["    const/4 v0, 0x1", "", "    return v0", ".end method", ""]
+    return "\n".join(out)
+
+
+def generate_colors(rng: random.Random, count: int) -> str:
+    out = ['<?xml version="1.0" encoding="utf-8"?>', "<resources>"]
+    for index in range(count):
+        out.append(f'    <color name="color_{index}">#ff{rng.randrange(0xFFFFFF):06x}</color>')
+    out.append("</resources>")
+    return "\n".join(out)
+
+
+def generate_layout(count: int) -> str:
+    out = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<LinearLayout xmlns:android="http://schemas.android.com/apk/res/android">',
+    ]
+    for index in range(count):
+        out.append(
+            f'    <TextView android:id="@+id/text_{index}" android:textColor="@color/color_{index % 50}" '
+            f'android:textSize="14sp" android:visibility="visible" />'
+        )
+    out.append("</LinearLayout>")
+    return "\n".join(out)
+
+
+def generate_manifest(count: int) -> dict:
+    return {
+        "repo": {"title": "benchmark", "uuid": str(uuid.UUID(int=0))},
+        "patches": [
+            {
+                "uuid": str(uuid.UUID(int=index + 1)),
+                "title": f"patch {index}",
+                "description": "synthetic patch",
+                "filename": f"patch_{index}.py",
+                "priority": index % 10,
+                "settings": {},
+            }
+            for index in range(count)
+        ],
+        "resources": [],
+    }
+
+
+def generate_tree(root: str, rng: random.Random) -> None:
+    for index in range(bench_args.files):
+        folder = os.path.join(root, "decompiled", "smali", "com", "bench", f"pkg{index % 16}")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"Class{index}.smali"), "w", encoding="utf-8") as file:
+            file.write(generate_smali(rng, index, bench_args.methods, bench_args.lines))
+
+    for mode in ("", "-night"):
+        folder = os.path.join(root, "decompiled", "res", f"values{mode}")
+        os.makedirs(folder)
+        with open(os.path.join(folder, "colors.xml"), "w", encoding="utf-8") as file:
+            file.write(generate_colors(rng, bench_args.colors))
+
+    folder = os.path.join(root, "decompiled", "res", "layout")
+    os.makedirs(folder)
+    with open(os.path.join(folder, "activity_main.xml"), "w", encoding="utf-8") as file:
+        file.write(generate_layout(bench_args.colors // 4))
+
+    repo = os.path.join(root, "repos", str(uuid.UUID(int=0)).replace("-", "_"))
+    os.makedirs(os.path.join(repo, "patches"))
+    manifest = generate_manifest(bench_args.patches)
+    with open(os.path.join(repo, "manifest.json"), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=4)
+    for patch in manifest["patches"]:
+        open(os.path.join(repo, "patches", patch["filename"]), "w").close()
+
+
+def time_calls(
+    run: Callable[[], object], setup: Callable[[], object] | None, number: int
+) -> float:
+    total = 0.0
+    for _ in range(number):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        total += time.perf_counter() - start
+    return total
+
+
+def reference_work() -> None:
+    # fixed pure python work, its time tells how fast the machine is right now
+    data = [str(index * 7919 % 10007) for index in range(20000)]
+    data.sort()
+    table = {value: index for index, value in enumerate(data)}
+    "".join(table).count("1")
+
+
+def time_cases(
+    cases: dict[str, tuple[Callable[[], object], Callable[[], object] | None]],
+) -> dict[str, float]:
+    # a millisecond case is mostly timer noise, each timed run loops it until it
+    # lasts min_time and counts the time of one call. Rounds go over all cases,
+    # so a slow spell on the machine spoils one run of each case, not all of one
+    numbers = {
+        name: max(1, math.ceil(bench_args.min_time / max(time_calls(run, setup, 1), 1e-6)))
+        for name, (run, setup) in cases.items()
+    }
+    results = dict.fromkeys(cases, math.inf)
+    for _ in range(bench_args.repeat):
+        for name, (run, setup) in cases.items():
+            seconds = time_calls(run, setup, numbers[name]) / numbers[name]
+            results[name] = min(results[name], seconds)
+    return results
+
+
+def restore(root: str, path: str) -> Callable[[], None]:
+    pristine = os.path.join(root, "pristine", os.path.relpath(path, root))
+    os.makedirs(os.path.dirname(pristine), exist_ok=True)
+    shutil.copy2(path, pristine)
+    return lambda: shutil.copy2(pristine, path)
+
+
+def make_cases(root: str) -> dict[str, tuple[Callable[[], object], Callable[[], object] | None]]:
+    decompiled = os.path.join(root, "decompiled")
+    smali_files = list_smali_files(decompiled)
+    smali_lines = [get_smali_lines(file) for file in smali_files]
+    documents = [SmaliDocument(lines, file) for file, lines in zip(smali_files, smali_lines)]
+    signatures = [(document, list(document.methods)) for document in documents]
+    replacements = {
+        "const/4 v0, 0x1": "const/4 v0, 0x0",
+        '"string_1_': '"patched_1_',
+        "Lcom/bench/pkg3/": "Lcom/patched/pkg3/",
+    }
+
+    colors_path = os.path.join(decompiled, "res", "values", "colors.xml")
+    night_path = os.path.join(decompiled, "res", "values-night", "colors.xml")
+    layout_path = os.path.join(decompiled, "res", "layout", "activity_main.xml")
+    restore_colors = [restore(root, colors_path), restore(root, night_path)]
+    restore_layout = restore(root, layout_path)
+    colors = {f"color_{index}": "#ff000000" for index in range(0, bench_args.colors, 10)}
+    android = "{" + config["xml_ns"]["android"] + "}"
+
+    repos = os.path.join(root, "repos")
+    repo_uuid = str(uuid.UUID(int=0))
+    warm_registry = RepositoryRegistry(repos)
+    warm_registry.get(repo_uuid)
+    titles = [f"patch {index}" for index in range(bench_args.patches)]
+
+    def lookup_methods() -> None:
+        for document, methods in signatures:
+            for signature in methods:
+                document.method(signature)
+            document.find_methods("method0")
+
+    def find_and_replace() -> None:
+        for lines in smali_lines:
+            find_and_replace_smali_lines(list(lines), replacements)
+
+    def recolor() -> None:
+        change_colors(colors)
+        change_colors(colors, "-night")
+
+    def recolor_session() -> None:
+        with XmlEditSession() as session:
+            for chunk in range(10):
+                session.change_colors(dict(list(colors.items())[chunk::10]))
+                session.change_colors(dict(list(colors.items())[chunk::10]), "-night")
+
+    def recolor_table() -> None:
+        with ResourceTable() as table:
+            table.update_colors(colors)
+
+    def warm_lookup() -> None:
+        for title in titles:
+            warm_registry.find_by_title(repo_uuid, title)
+
+    return {
+        "smali.parse": (
+            lambda: [SmaliDocument(list(lines), file) for file, lines in zip(smali_files, smali_lines)],
+            None,
+        ),
+        "smali.method_lookup": (lookup_methods, None),
+        "smali.find_and_replace": (find_and_replace, None),
+        "smali.search": (
+            lambda: search_smali("Lcom/bench/pkg7/Class", decompiled, workers=1),
+            None,
+        ),
+        "xml.change_colors": (recolor, lambda: [reset() for reset in restore_colors]),
+        "xml.session_change_colors": (recolor_session, lambda: [reset() for reset in restore_colors]),
+        "xml.resource_table_colors": (recolor_table, lambda: [reset() for reset in restore_colors]),
+        "xml.change_attributes": (
+            lambda: change_attributes(layout_path, {f"{android}textSize": "16sp"}),
+            restore_layout,
+        ),
+        "xml.change_attributes_all": (
+            lambda: change_attributes_all(layout_path, {f"{android}textSize": "16sp"}),
+            restore_layout,
+        ),
+        "xml.change_attributes_with_value": (
+            lambda: change_attributes_with_value(
+                layout_path, {f"{android}textColor": "@color/color_1"}, "@color/color_49"
+            ),
+            restore_layout,
+        ),
+        "xml.change_attributes_all_with_value": (
+            lambda: change_attributes_all_with_value(
+                layout_path, {f"{android}textColor": "@color/color_1"}, "@color/color_49"
+            ),
+            restore_layout,
+        ),
+        "manifest.load": (lambda: load_manifest(warm_registry.repo_path(repo_uuid)), None),
+        "manifest.registry_cold": (lambda: RepositoryRegistry(repos).get(repo_uuid), None),
+        "manifest.registry_lookup": (warm_lookup, None),
+    }
+
+
+def bench_params() -> dict:
+    return {
+        key: getattr(bench_args, key)
+        for key in ("files", "methods", "lines", "colors", "patches", "seed", "min_time")
+    }
+
+
+def main() -> int:
+    baseline = None
+    if not bench_args.save_baseline:
+        if not os.path.exists(bench_args.baseline):
+            print(f"no baseline at {bench_args.baseline}, record one with --save-baseline")
+            return 1
+        with open(bench_args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["params"] != bench_params():
+            print(f"baseline was recorded with {baseline['params']}, can't compare")
+            return 1
+
+    root = tempfile.mkdtemp(prefix="anixart-bench-")
+    try:
+        generate_tree(root, random.Random(bench_args.seed))
+        config["folders"]["decompiled"] = os.path.join(root, "decompiled")
+        results = time_cases(
+            {
+                name: case
+                for name, case in make_cases(root).items()
+                if not bench_args.only or bench_args.only in name
+            }
+            | {"reference": (reference_work, None)}
+        )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    # baseline times are scaled by how much faster or slower the machine runs
+    # the reference work now, a busy or throttled machine slows every case
+    speed = 1.0
+    if baseline and "reference" in baseline["results"]:
+        speed = results["reference"] / baseline["results"]["reference"]
+        print(f"machine speed against the baseline: {1 / speed:.2f}x")
+
+    regressions = []
+    print(f"{'case':40} {'seconds':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in results.items():
+        previous = baseline["results"].get(name) if baseline else None
+        if previous is None or name == "reference":
+            print(f"{name:40} {seconds:10.4f} {'-':>10} {'-':>8}")
+            continue
+        previous *= speed
+        change = seconds / previous - 1
+        print(f"{name:40} {seconds:10.4f} {previous:10.4f} {change:+8.1%}")
+        if change > bench_args.threshold and seconds - previous > bench_args.noise_floor:
+            regressions.append(name)
+
+    if bench_args.save_baseline:
+        with open(bench_args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"params": bench_params(), "results": results}, file, indent=4)
+        print(f"baseline saved to {bench_args.baseline}")
+
+    if regressions:
+        print(f"REGRESSION over {bench_args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
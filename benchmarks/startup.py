@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATCHER = os.path.join(ROOT, "patcher.py")
+BASELINE = os.path.join(os.path.dirname(__file__), "startup_baseline.json")
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+COMMANDS = {
+    "help": ["--help"],
+    "list": ["--list", "compact"],
+    "generate-settings-file": ["--generate-settings-file"],
+}
+
+parser = argparse.ArgumentParser(
+    description="measure how long quick patcher commands take to start, "
+    "run from the repo root with `python -m benchmarks.startup`"
+)
+parser.add_argument("--repeat", help="runs per command, the fastest one counts", type=int, default=10)
+parser.add_argument("--imports", help="show the slowest top level imports of `--list`", type=int, default=10)
+parser.add_argument("--baseline", help="baseline json file", type=str, default=BASELINE)
+parser.add_argument("--save-baseline", help="store the results as the new baseline", action="store_true")
+parser.add_argument("--threshold", help="allowed slowdown against the baseline, 0.25 = 25%%", type=float, default=0.25)
+
+
+def make_workdir() -> str:
+    # no repositories, so the commands only pay for startup
+    workdir = tempfile.mkdtemp(prefix="anixart-startup-")
+    with open(os.path.join(ROOT, "config.json"), "r", encoding="utf-8") as file:
+        config = json.load(file)
+    config["repositories"] = []
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as file:
+        json.dump(config, file)
+    return workdir
+
+
+def time_command(workdir: str, command: list[str], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, PATCHER, *command],
+            cwd=workdir,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def slowest_imports(workdir: str, command: list[str], count: int) -> list[tuple[str, float]]:
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", PATCHER, *command],
+        cwd=workdir,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    ).stderr
+    imports = []
+    for match in IMPORT_TIME.finditer(output):
+        # only modules imported directly, nested ones are in their parent's time
+        if len(match.group(3)) == 1:
+            imports.append((match.group(4), int(match.group(2)) / 1000))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:count]
+
+
+def main() -> int:
+    bench_args = parser.parse_args()
+    baseline = None
+    if not bench_args.save_baseline:
+        if not os.path.exists(bench_args.baseline):
+            print(f"no baseline at {bench_args.baseline}, record one with --save-baseline")
+            return 1
+        with open(bench_args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    workdir = make_workdir()
+    try:
+        results = {
+            name: time_command(workdir, command, bench_args.repeat)
+            for name, command in COMMANDS.items()
+        }
+        imports = slowest_imports(workdir, COMMANDS["list"], bench_args.imports)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = []
+    print(f"{'command':30} {'ms':>10} {'baseline':>10} {'change':>8}")
+    for name, seconds in results.items():
+        previous = baseline.get(name) if baseline else None
+        if previous is None:
+            print(f"{name:30} {seconds * 1000:10.1f} {'-':>10} {'-':>8}")
+            continue
+        change = seconds / previous - 1
+        print(f"{name:30} {seconds * 1000:10.1f} {previous * 1000:10.1f} {change:+8.1%}")
+        if change > bench_args.threshold:
+            regressions.append(name)
+
+    print("\nslowest imports of `--list`:")
+    for module, ms in imports:
+        print(f"  {module:40} {ms:8.1f} ms")
+
+    if bench_args.save_baseline:
+        with open(bench_args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"baseline saved to {bench_args.baseline}")
+
+    if regressions:
+        print(f"REGRESSION over {bench_args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,10 +1,27 @@
 import argparse
+import functools
 import json
 import logging
 import os
-from typing import TypedDict
-from rich.logging import RichHandler
-from rich.console import Console
+from typing import TYPE_CHECKING, NotRequired, TypedDict
+
+if TYPE_CHECKING:
+    from rich.console import Console
+
+
+class LazyRichHandler(logging.Handler):
+    # rich is only imported once something is actually logged
+    def __init__(self):
+        super().__init__()
+        self.handler = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.handler is None:
+            from rich.logging import RichHandler
+
+            self.handler = RichHandler(rich_tracebacks=True)
+            self.handler.setFormatter(self.formatter)
+        self.handler.emit(record)
 
 
 FORMAT = "%(message)s"
@@ -12,29 +29,55 @@ logging.basicConfig(
     level="NOTSET",
     format=FORMAT,
     datefmt="[%X]",
-    handlers=[RichHandler(rich_tracebacks=True)],
+    handlers=[LazyRichHandler()],
 )
 log = logging.getLogger("rich")
-console = Console()
 
 parser = argparse.ArgumentParser(prog="anixart patcher")
 parser.add_argument("--config", help="path to config.json file", default="config.json")
 parser.add_argument("--no-decompile", action="store_true")
+parser.add_argument("--no-cache", help="always decompile with apktool, bypassing the decompile cache", action="store_true")
 parser.add_argument("--no-compile", action="store_true")
+parser.add_argument("--patch-cache", help="replay cached file changes of patches whose inputs didn't change instead of running them", action="store_true")
+parser.add_argument("--incremental", help="reuse cached dex/resources for parts of the apk no patch changed", action="store_true")
 parser.add_argument("--sign-only", action="store_true")
+parser.add_argument("--jvm-daemon", help="run apktool and apksigner in one long-lived JVM", action="store_true")
 parser.add_argument("--repo-add", help="add a new repo to config.json file", type=str, default=None)
 parser.add_argument("--repo-update", help="fetch latest version of all repos", action="store_true")
+parser.add_argument("--bundle-export", help="write repos and tools into an offline bundle file", type=str, default=None)
+parser.add_argument("--bundle-base", help="previous bundle (or its index.json), objects it already has are left out of --bundle-export", type=str, default=None)
+parser.add_argument("--bundle-import", help="import repos and tools from an offline bundle file", type=str, default=None)
 parser.add_argument("--generate-settings-file", help="Generates a settings.json file with default settings from all repos for all patches", action="store_true")
 parser.add_argument("--settings-file", help="path to settings.json file with custom values", type=str, default=None)
 parser.add_argument("--list", help="list all patches", choices=["compact", "full"], default=None)
 parser.add_argument("--apk", help="apk file name to patch", type=str, default=None)
-args = parser.parse_args()
+parser.add_argument("--batch", help="patch several apks in parallel (all apks in the `apks` folder if none are given), requires --settings-file", nargs="*", default=None)
+parser.add_argument("--headless", help="patch without any prompts using a profile file (a settings file with a `run` section), exits with a status code and writes a json result", type=str, default=None)
+parser.add_argument("--serve", help="run as a local build service that takes patch jobs over http", action="store_true")
+parser.add_argument("--submit", help="submit the apks of a profile file to the local build service and wait for the results", type=str, default=None)
+parser.add_argument("--port", help="port of the local build service", type=int, default=8765)
+parser.add_argument("--jobs", help="number of parallel batch or service workers", type=int, default=2)
+parser.add_argument("--profile", help="write per-stage and per-patch timings as json to this file", type=str, default=None)
+parser.add_argument("--profile-trace", help="write the timings in chrome trace format (chrome://tracing, perfetto) to this file", type=str, default=None)
+
+
+@functools.cache
+def get_args() -> argparse.Namespace:
+    return parser.parse_args()
+
+
+@functools.cache
+def get_console() -> "Console":
+    from rich.console import Console
+
+    return Console()
 
 
 class ConfigTools(TypedDict):
     tool: str
     url: str
     os: list[str]
+    segments: NotRequired[int]
 
 
 class ConfigFolders(TypedDict):
@@ -42,6 +85,7 @@ class ConfigFolders(TypedDict):
     apks: str
     decompiled: str
     out: str
+    cache: str
 
 
 class ConfigXmlNS(TypedDict):
@@ -56,6 +100,14 @@ class RepoList(TypedDict):
 
 class ScriptConfig(TypedDict):
     log_level: str
+    decompile_cache_size_mb: int
+    patch_cache_size_mb: int
+    worktree_mode: str
+    download_workers: int
+    download_retries: int
+    patch_workers: int
+    service_job_retention_hours: float
+    service_max_finished_jobs: int
     repositories: list[RepoList]
     tools: list[ConfigTools]
     folders: ConfigFolders
@@ -65,6 +117,7 @@ class ScriptConfig(TypedDict):
 def load_config() -> ScriptConfig:
     config = None
 
+    args = get_args()
     if not os.path.exists(args.config):
         log.exception("file `config.json` is not found!")
         exit(1)
@@ -73,8 +126,32 @@ def load_config() -> ScriptConfig:
         config = json.loads(file.read())
 
     log.setLevel(config.get("log_level", "NOTSET").upper())
+    config["folders"].setdefault("cache", "cache")
+    config.setdefault("decompile_cache_size_mb", 8192)
+    config.setdefault("patch_cache_size_mb", 2048)
+    config.setdefault("worktree_mode", "reflink")
+    config.setdefault("download_workers", 8)
+    config.setdefault("download_retries", 5)
+    config.setdefault("patch_workers", 4)
+    config.setdefault("service_job_retention_hours", 24)
+    config.setdefault("service_max_finished_jobs", 100)
 
     return config
 
 
-config = load_config()
+@functools.cache
+def get_config() -> ScriptConfig:
+    return load_config()
+
+
+LAZY_ATTRIBUTES = {"args": get_args, "config": get_config, "console": get_console}
+
+
+def __getattr__(name: str):
+    # `from config import config` keeps working, argv and config.json are
+    # read on first use instead of on import
+    if name in LAZY_ATTRIBUTES:
+        value = LAZY_ATTRIBUTES[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
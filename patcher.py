@@ -1,34 +1,32 @@
-from scripts.download_tools import check_and_download_all_tools
-from scripts.patch_funcs import (
-    PatchGlobals,
-    generate_settings_file,
-    print_patches,
-    select_and_apply_patches,
-)
-from scripts.repository import add_repository, fetch_repositories
-from scripts.utils import (
-    check_java_version,
-    compile_apk,
-    decompile_apk,
-    list_apks,
-    read_apktool_yml,
-    select_apk,
-    sign_apk,
-)
+# subcommands import what they need, `--list` shouldn't pay for requests and lxml
 from config import args, config, log
-from beaupy import confirm
 import shutil
 import os
-import json
 
 if __name__ == "__main__":
     if args.repo_add:
+        from scripts.repository import add_repository
+
         add_repository(args.repo_add)
         exit(0)
     if args.repo_update:
+        from scripts.repository import fetch_repositories
+
         fetch_repositories()
         exit(0)
+    if args.bundle_export:
+        from scripts.bundle import export_bundle
+
+        export_bundle(args.bundle_export, args.bundle_base)
+        exit(0)
+    if args.bundle_import:
+        from scripts.bundle import import_bundle
+
+        import_bundle(args.bundle_import)
+        exit(0)
     if args.sign_only:
+        from scripts.utils import sign_apk
+
         outs = os.listdir(config["folders"]["out"])
         for out in outs:
             if out.endswith("-patched.apk"):
@@ -37,37 +35,72 @@ if __name__ == "__main__":
                 os.remove(f"{config['folders']['out']}/{out}")
         exit(0)
     if args.list:
+        from scripts.patch_funcs import print_patches
+
         print_patches()
         exit(0)
+    if args.submit:
+        from scripts.service import submit_jobs
+
+        exit(submit_jobs(args.port, args.submit, args.apk))
     if args.generate_settings_file:
+        from scripts.patch_funcs import generate_settings_file
+
         generate_settings_file()
         exit(0)
 
+    from scripts.download_tools import check_and_download_all_tools
+    from scripts.profiler import profiler
+    from scripts.utils import check_java_version, list_apks
+
+    if args.profile or args.profile_trace:
+        profiler.enable(args.profile, args.profile_trace)
+
     check_and_download_all_tools()
     check_java_version()
 
+    if args.serve:
+        from scripts.service import serve
+
+        serve(args.port, args.jobs)
+        exit(0)
+    if args.headless:
+        from scripts.headless import run_headless
+
+        exit(run_headless(args.headless, args.jobs))
+
+    if args.batch is not None:
+        if not args.settings_file:
+            log.error("batch mode needs a `--settings-file` with the patches to apply")
+            exit(1)
+        from scripts.pipeline import load_settings_file, print_batch_summary, run_batch
+
+        apks = args.batch or list_apks()
+        if not apks:
+            log.info("no apks found")
+            exit(0)
+        with profiler.stage("batch"):
+            results = run_batch(apks, load_settings_file(args.settings_file), args.jobs)
+        print_batch_summary(results)
+        exit(0 if all(result["status"] == "ok" for result in results) else 1)
+
+    from beaupy import confirm
+    from scripts.patch_funcs import select_and_apply_patches
+    from scripts.pipeline import (
+        build_patched_apk,
+        load_settings_file,
+        make_patch_globals,
+        prepare_decompiled,
+    )
+    from scripts.utils import select_apk
+
     apk = args.apk or select_apk(list_apks())
     log.info(f"selected apk: {apk}")
 
-    if not args.no_decompile:
-        log.info("Decompile APK")
-        decompile_apk(f"{config['folders']['apks']}/{apk}")
-
-    versionName, versionCode, sdkMin, sdkMax = read_apktool_yml()
-    globals: PatchGlobals = {
-        "apk": apk,
-        "app_version_name": versionName,
-        "app_version_code": versionCode,
-        "app_sdk_version_min": sdkMin,
-        "app_sdk_version_max": sdkMax,
-        "patches_enabled": [],
-        "patches_statuses": [],
-        "settings_override": None,
-    }
-
-    if args.settings_file:
-        with open(args.settings_file, "r", encoding="utf-8") as file:
-            globals["settings_override"] = json.loads(file.read())
+    prepare_decompiled(f"{config['folders']['apks']}/{apk}")
+    globals = make_patch_globals(
+        apk, load_settings_file(args.settings_file) if args.settings_file else None
+    )
 
     statuses = select_and_apply_patches(globals)
     for status in statuses:
@@ -81,11 +114,7 @@ if __name__ == "__main__":
 
     if not args.no_compile:
         shutil.rmtree(config["folders"]["out"], ignore_errors=True)
-        newApk = apk.removesuffix(".apk") + "-patched.apk"
-        log.info("Compile APK")
-        compile_apk(f"{config['folders']['out']}/{newApk}")
-        log.info("Zipalign and Sign APK")
-        sign_apk(f"{config['folders']['out']}/{newApk}")
+        build_patched_apk(apk)
 
     log.info("Finished")
     exit(0)
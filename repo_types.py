@@ -28,6 +28,9 @@ class PatchMetaData(TypedDict):
     priority: int
     tags: list[str]
     settings: NotRequired[dict[str, Any]]
+    reads: NotRequired[list[str]]
+    writes: NotRequired[list[str]]
+    depends: NotRequired[list[str]]
 
 
 class ResourceMetaData(TypedDict):
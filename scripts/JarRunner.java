@@ -0,0 +1,117 @@
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.jar.JarFile;
+
+// Keeps one JVM warm for apktool/apksigner. Protocol on stdin/stdout:
+//   <- READY guarded|unguarded
+//   -> <jar>\t<arg>\t<arg>...
+//   <- DONE <exit status>
+// Tool output is redirected to stderr so it never mixes with the protocol.
+public class JarRunner {
+    static class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("exit " + status);
+            this.status = status;
+        }
+    }
+
+    static final Map<String, Method> mains = new HashMap<>();
+
+    @SuppressWarnings("removal")
+    static boolean installExitGuard() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitException(status);
+                }
+
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    static Method findMain(String jar) throws Exception {
+        Method main = mains.get(jar);
+        if (main != null) {
+            return main;
+        }
+        File file = new File(jar).getAbsoluteFile();
+        String mainClass;
+        try (JarFile jarFile = new JarFile(file)) {
+            mainClass = jarFile.getManifest().getMainAttributes().getValue("Main-Class");
+        }
+        URLClassLoader loader = new URLClassLoader(
+                new URL[] { file.toURI().toURL() }, ClassLoader.getPlatformClassLoader());
+        main = Class.forName(mainClass, true, loader).getMethod("main", String[].class);
+        mains.put(jar, main);
+        return main;
+    }
+
+    static int run(String jar, String[] args) {
+        Thread thread = Thread.currentThread();
+        ClassLoader previous = thread.getContextClassLoader();
+        try {
+            Method main = findMain(jar);
+            thread.setContextClassLoader(main.getDeclaringClass().getClassLoader());
+            main.invoke(null, (Object) args);
+            return 0;
+        } catch (InvocationTargetException e) {
+            if (e.getCause() instanceof ExitException) {
+                return ((ExitException) e.getCause()).status;
+            }
+            e.getCause().printStackTrace();
+            return 1;
+        } catch (ExitException e) {
+            return e.status;
+        } catch (Throwable e) {
+            e.printStackTrace();
+            return 1;
+        } finally {
+            thread.setContextClassLoader(previous);
+        }
+    }
+
+    public static void main(String[] argv) throws Exception {
+        PrintStream control = System.out;
+        System.setOut(System.err);
+        boolean guarded = installExitGuard();
+        control.println("READY " + (guarded ? "guarded" : "unguarded"));
+        control.flush();
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            String[] parts = line.split("\t", -1);
+            int status = run(parts[0], Arrays.copyOfRange(parts, 1, parts.length));
+            System.err.flush();
+            control.println("DONE " + status);
+            control.flush();
+        }
+    }
+}
@@ -0,0 +1,102 @@
+import os
+import shutil
+import time
+from config import config, log
+from scripts.worktree import modified_files, read_worktree_marker
+
+RESOURCE_OUTPUTS = ["resources.arsc", "AndroidManifest.xml", "res"]
+RESOURCE_INPUTS = ["AndroidManifest.xml", "res", "apktool.yml"]
+
+
+def build_cache_path(key: str) -> str:
+    return os.path.join(config["folders"]["cache"], "build", key)
+
+
+def dex_for_smali_folder(folder: str) -> str:
+    # smali -> classes.dex, smali_classes2 -> classes2.dex
+    return f"{folder.removeprefix('smali_')}.dex" if folder != "smali" else "classes.dex"
+
+
+def find_changed_outputs(pristine: str, work: str) -> tuple[set[str], bool]:
+    changed_dex = set()
+    resources_changed = False
+    for path in modified_files(pristine, work, ignore=("build", "dist")):
+        top = path.split(os.sep, 1)[0]
+        if top.startswith("smali"):
+            changed_dex.add(dex_for_smali_folder(top))
+        elif top in RESOURCE_INPUTS:
+            resources_changed = True
+    return changed_dex, resources_changed
+
+
+def touch_tree(path: str, now: float) -> None:
+    os.utime(path, (now, now))
+    if not os.path.isdir(path):
+        return
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(dirpath, name), (now, now))
+
+
+def prepare_incremental_build() -> tuple[str, set[str], bool] | None:
+    work = config["folders"]["decompiled"]
+    marker = read_worktree_marker(work)
+    if marker is None or not os.path.isdir(marker["pristine"]):
+        log.warning("working tree has no pristine copy, running a full build")
+        return None
+
+    key = os.path.basename(marker["pristine"])
+    cache = build_cache_path(key)
+    changed_dex, resources_changed = find_changed_outputs(marker["pristine"], work)
+
+    build_apk = os.path.join(work, "build", "apk")
+    shutil.rmtree(os.path.join(work, "build"), ignore_errors=True)
+    os.makedirs(build_apk)
+
+    # apktool skips a dex or the resources when the output is newer than its sources
+    now = time.time()
+    reused = []
+    for folder in os.listdir(work):
+        dex = dex_for_smali_folder(folder)
+        if not folder.startswith("smali") or dex in changed_dex:
+            continue
+        if os.path.exists(os.path.join(cache, dex)):
+            shutil.copy2(os.path.join(cache, dex), os.path.join(build_apk, dex))
+            touch_tree(os.path.join(build_apk, dex), now)
+            reused.append(dex)
+    if not resources_changed and os.path.isdir(os.path.join(cache, "resources")):
+        shutil.copytree(os.path.join(cache, "resources"), build_apk, dirs_exist_ok=True)
+        for output in RESOURCE_OUTPUTS:
+            touch_tree(os.path.join(build_apk, output), now)
+        reused.append("resources")
+
+    log.info(
+        f"incremental build: rebuilding {sorted(changed_dex) or 'no dex'}"
+        f"{' and resources' if resources_changed else ''}, reusing {reused or 'nothing'}"
+    )
+    return key, changed_dex, resources_changed
+
+
+def store_build_outputs(key: str, changed_dex: set[str], resources_changed: bool) -> None:
+    cache = build_cache_path(key)
+    build_apk = os.path.join(config["folders"]["decompiled"], "build", "apk")
+    os.makedirs(cache, exist_ok=True)
+
+    for name in os.listdir(build_apk):
+        if not name.endswith(".dex") or name in changed_dex:
+            continue
+        if not os.path.exists(os.path.join(cache, name)):
+            shutil.copy2(os.path.join(build_apk, name), os.path.join(cache, name))
+
+    resources = os.path.join(cache, "resources")
+    if resources_changed or os.path.isdir(resources):
+        return
+    shutil.rmtree(f"{resources}.tmp", ignore_errors=True)
+    os.makedirs(f"{resources}.tmp")
+    for output in RESOURCE_OUTPUTS:
+        source = os.path.join(build_apk, output)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(f"{resources}.tmp", output))
+        elif os.path.exists(source):
+            shutil.copy2(source, os.path.join(f"{resources}.tmp", output))
+    os.replace(f"{resources}.tmp", resources)
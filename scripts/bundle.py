@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+from config import config, log, args
+from scripts.downloader import HashCache
+
+BUNDLE_VERSION = 1
+SKIPPED_FILES = ["http_cache.json", "hashes.json"]
+
+
+def list_bundle_files() -> list[str]:
+    files = []
+    for root in ["repos", config["folders"]["tools"]]:
+        if not os.path.isdir(root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+            files.extend(
+                os.path.join(dirpath, name)
+                for name in filenames
+                if name not in SKIPPED_FILES and not name.endswith((".part", ".part.meta", ".tmp"))
+            )
+    return sorted(files)
+
+
+def hash_cache_for(path: str, hash_caches: dict[str, HashCache]) -> HashCache:
+    # repos keep one hash cache per repository, tools share one
+    parts = path.split(os.sep)
+    cache_dir = os.path.join(*parts[:2]) if parts[0] == "repos" else parts[0]
+    if cache_dir not in hash_caches:
+        os.makedirs(cache_dir, exist_ok=True)
+        hash_caches[cache_dir] = HashCache(os.path.join(cache_dir, "hashes.json"))
+    return hash_caches[cache_dir]
+
+
+def to_bundle_path(path: str) -> str:
+    if path.startswith(config["folders"]["tools"] + os.sep):
+        path = "tools" + path[len(config["folders"]["tools"]) :]
+    return path.replace(os.sep, "/")
+
+
+def from_bundle_path(path: str) -> str | None:
+    parts = path.split("/")
+    if parts[0] not in ("repos", "tools") or len(parts) < 2:
+        return None
+    if any(part in ("", ".", "..") or "\\" in part or ":" in part for part in parts):
+        return None
+    root = "repos" if parts[0] == "repos" else config["folders"]["tools"]
+    file = os.path.join(root, *parts[1:])
+    # symlinks inside repos/ or tools/ must not lead out of them either
+    real_root = os.path.realpath(root)
+    if os.path.commonpath([real_root, os.path.realpath(file)]) != real_root:
+        return None
+    return file
+
+
+def read_bundle_index(path: str) -> dict:
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    with zipfile.ZipFile(path) as bundle:
+        return json.loads(bundle.read("index.json"))
+
+
+def export_bundle(path: str, base: str | None = None):
+    known = set()
+    if base is not None:
+        known = {entry["sha256"] for entry in read_bundle_index(base)["files"]}
+
+    hash_caches: dict[str, HashCache] = {}
+    index = {
+        "version": BUNDLE_VERSION,
+        "created": time.time(),
+        "repositories": config["repositories"],
+        "tools": config["tools"],
+        "files": [],
+    }
+    written = set()
+    with zipfile.ZipFile(f"{path}.tmp", "w", zipfile.ZIP_DEFLATED) as bundle:
+        for file in list_bundle_files():
+            sha256 = hash_cache_for(file, hash_caches).sha256(file)
+            index["files"].append(
+                {
+                    "path": to_bundle_path(file),
+                    "sha256": sha256,
+                    "size": os.path.getsize(file),
+                }
+            )
+            if sha256 in known or sha256 in written:
+                continue
+            bundle.write(file, f"objects/{sha256}")
+            written.add(sha256)
+        bundle.writestr("index.json", json.dumps(index, indent=4, ensure_ascii=False))
+    os.replace(f"{path}.tmp", path)
+    for hash_cache in hash_caches.values():
+        hash_cache.save()
+
+    log.info(
+        f"bundle exported: {path}, {len(index['files'])} files, {len(written)} objects"
+        + (f", {len(known)} objects left to the base bundle" if base else "")
+    )
+
+
+def import_bundle(path: str):
+    hash_caches: dict[str, HashCache] = {}
+    with zipfile.ZipFile(path) as bundle:
+        index = json.loads(bundle.read("index.json"))
+        if index.get("version") != BUNDLE_VERSION:
+            log.error(f"unsupported bundle version: {index.get('version')}")
+            exit(1)
+
+        objects = set(bundle.namelist())
+        local: dict[str, str] = {}
+        pending = []
+        # every path is checked before anything is written
+        for entry in index["files"]:
+            file = from_bundle_path(entry["path"])
+            if file is None:
+                log.error(f"bundle path `{entry['path']}` is outside of repos and tools")
+                exit(1)
+            sha256 = hash_cache_for(file, hash_caches).sha256(file)
+            if sha256 == entry["sha256"]:
+                local[sha256] = file
+            else:
+                pending.append((file, entry))
+
+        for file, entry in pending:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            if f"objects/{entry['sha256']}" in objects:
+                digest = hashlib.sha256()
+                with bundle.open(f"objects/{entry['sha256']}") as source, open(
+                    f"{file}.part", "wb"
+                ) as target:
+                    while chunk := source.read(1024 * 1024):
+                        digest.update(chunk)
+                        target.write(chunk)
+                if digest.hexdigest() != entry["sha256"]:
+                    os.remove(f"{file}.part")
+                    log.error(
+                        f"bundle object for `{entry['path']}` is corrupt: sha256 {digest.hexdigest()}, expected {entry['sha256']}"
+                    )
+                    exit(1)
+            elif entry["sha256"] in local:
+                shutil.copyfile(local[entry["sha256"]], f"{file}.part")
+            else:
+                log.error(
+                    f"bundle is missing object {entry['sha256']} for `{entry['path']}`, import its base bundle first"
+                )
+                exit(1)
+            os.replace(f"{file}.part", file)
+            hash_cache_for(file, hash_caches).record(file, entry["sha256"])
+            local[entry["sha256"]] = file
+
+    for hash_cache in hash_caches.values():
+        hash_cache.save()
+    if os.name == "posix":
+        for tool in index["tools"]:
+            tool_path = os.path.join(config["folders"]["tools"], tool["tool"])
+            if os.path.isfile(tool_path):
+                os.chmod(tool_path, 0o744)
+
+    changed = False
+    for repo in index["repositories"]:
+        if not any(r["uuid"] == repo["uuid"] for r in config["repositories"]):
+            config["repositories"].append(repo)
+            changed = True
+    for tool in index["tools"]:
+        if not any(t["tool"] == tool["tool"] for t in config["tools"]):
+            config["tools"].append(tool)
+            changed = True
+    if changed:
+        with open(args.config, "w", encoding="utf-8") as file:
+            json.dump(config, file, indent=4, ensure_ascii=False)
+
+    log.info(
+        f"bundle imported: {len(pending)} of {len(index['files'])} files updated"
+    )
@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from config import config, log
+from scripts.utils import decompile_apk, sha256_file
+from scripts.worktree import checkout_worktree, remove_tree
+
+
+def decompile_cache_root() -> str:
+    return os.path.join(config["folders"]["cache"], "decompiled")
+
+
+def decompile_cache_key(apk_path: str) -> str:
+    apktool_sha256 = sha256_file(f"{config['folders']['tools']}/apktool.jar")
+    return f"{sha256_file(apk_path)}-{apktool_sha256[:16]}"
+
+
+def tree_size(path: str) -> int:
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            size += os.lstat(os.path.join(dirpath, name)).st_size
+    return size
+
+
+@contextmanager
+def cache_lock(key: str, blocking: bool = True):
+    # held while an entry is created, checked out or evicted, batch jobs and
+    # service workers may use the same apk at once
+    os.makedirs(decompile_cache_root(), exist_ok=True)
+    with open(os.path.join(decompile_cache_root(), f"{key}.lock"), "a+b") as file:
+        if os.name == "nt":
+            import msvcrt
+
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if not blocking:
+                        yield False
+                        return
+                    time.sleep(0.1)
+            try:
+                yield True
+            finally:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+
+        import fcntl
+
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            yield False
+            return
+        # closing the file drops the lock
+        yield True
+
+
+def load_cache_meta(key: str) -> dict | None:
+    try:
+        with open(
+            os.path.join(decompile_cache_root(), f"{key}.json"), "r", encoding="utf-8"
+        ) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cache_meta(key: str, meta: dict) -> None:
+    path = os.path.join(decompile_cache_root(), f"{key}.json")
+    with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as file:
+        json.dump(meta, file, indent=4)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def evict_decompile_cache(keep: str) -> None:
+    limit = config["decompile_cache_size_mb"] * 1024 * 1024
+    entries = []
+    for name in os.listdir(decompile_cache_root()):
+        key = name.removesuffix(".json")
+        if not name.endswith(".json") or key == keep:
+            continue
+        meta = load_cache_meta(key)
+        if meta is not None:
+            entries.append((meta["last_used"], key, meta["size"]))
+
+    total = sum(size for _, _, size in entries)
+    total += (load_cache_meta(keep) or {}).get("size", 0)
+    for _, key, size in sorted(entries):
+        if total <= limit:
+            break
+        with cache_lock(key, blocking=False) as locked:
+            # an entry another job is using stays, the next eviction gets it
+            if not locked or load_cache_meta(key) is None:
+                continue
+            log.info(f"evicting decompile cache entry: {key}")
+            os.remove(os.path.join(decompile_cache_root(), f"{key}.json"))
+            remove_tree(os.path.join(decompile_cache_root(), key))
+            shutil.rmtree(
+                os.path.join(config["folders"]["cache"], "build", key), ignore_errors=True
+            )
+        total -= size
+
+
+def get_pristine_tree(apk_path: str, key: str) -> str:
+    # the caller holds cache_lock(key), a tree without meta is a leftover of an
+    # interrupted run and nobody else can be using it
+    pristine = os.path.join(decompile_cache_root(), key)
+    meta = load_cache_meta(key)
+
+    if meta is None or not os.path.isdir(pristine):
+        log.info("decompile cache miss, running apktool")
+        remove_tree(pristine)
+        tmp_path = f"{pristine}.{os.getpid()}.tmp"
+        remove_tree(tmp_path)
+        decompile_apk(apk_path, tmp_path)
+        os.replace(tmp_path, pristine)
+        meta = {"apk": os.path.basename(apk_path), "size": tree_size(pristine)}
+    else:
+        log.info(f"decompile cache hit: {key}")
+
+    meta["last_used"] = time.time()
+    save_cache_meta(key, meta)
+    return pristine
+
+
+def restore_decompiled(apk_path: str) -> str:
+    key = decompile_cache_key(apk_path)
+    with cache_lock(key):
+        pristine = get_pristine_tree(apk_path, key)
+        checkout_worktree(
+            pristine, config["folders"]["decompiled"], config["worktree_mode"]
+        )
+    evict_decompile_cache(key)
+    return key
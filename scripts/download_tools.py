@@ -1,28 +1,34 @@
+import functools
 import os
-import requests
 import logging
-from config import config, log, console
-from rich.progress import (
-    BarColumn,
-    DownloadColumn,
-    Progress,
-    TextColumn,
-    TimeRemainingColumn,
-    TransferSpeedColumn,
-)
-
-progress = Progress(
-    TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-    BarColumn(bar_width=None),
-    "[progress.percentage]{task.percentage:>3.1f}%",
-    "•",
-    DownloadColumn(),
-    "•",
-    TransferSpeedColumn(),
-    "•",
-    TimeRemainingColumn(),
-    console=console
-)
+from config import config, log
+
+
+# requests and rich.progress are only needed once a tool is missing
+@functools.cache
+def get_progress():
+    from config import console
+    from rich.progress import (
+        BarColumn,
+        DownloadColumn,
+        Progress,
+        TextColumn,
+        TimeRemainingColumn,
+        TransferSpeedColumn,
+    )
+
+    return Progress(
+        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+        BarColumn(bar_width=None),
+        "[progress.percentage]{task.percentage:>3.1f}%",
+        "•",
+        DownloadColumn(),
+        "•",
+        TransferSpeedColumn(),
+        "•",
+        TimeRemainingColumn(),
+        console=console
+    )
 
 
 def check_if_tools_folder_exist():
@@ -47,30 +53,35 @@ requests_log = logging.getLogger("urllib3.connectionpool")
 requests_log.setLevel(logging.WARNING)
 
 
-def prepare_download_tool(url: str, tool: str):
+def prepare_download_tool(url: str, tool: str, segments: int = 1):
     if check_if_tool_exists(tool):
         return
 
+    progress = get_progress()
     progress.start()
     try:
-        download_tool(url, tool)
+        download_tool(url, tool, segments)
     except Exception as e:
         log.error(f"error while downloading `{tool}`: {e}")
     finally:
         progress.stop()
 
-def download_tool(url, tool):
-    log.info(f"Requesting {url}")
-    response = requests.get(url, stream=True)
-    total = int(response.headers.get("content-length", None))
-    task_id = progress.add_task(f"download-{tool}", start=False, total=total, filename=tool)
+def download_tool(url, tool, segments: int = 1):
+    from scripts.downloader import DownloadError, download_to_file
 
-    with open(f"{config['folders']['tools']}/{tool}", "wb") as file:
-        progress.start_task(task_id)
-        for bytes in response.iter_content(chunk_size=32768):
-            size = file.write(bytes)
-            progress.update(task_id, advance=size)
-    progress.remove_task(task_id)
+    log.info(f"Requesting {url}")
+    response, digest = download_to_file(
+        url,
+        f"{config['folders']['tools']}/{tool}",
+        tool,
+        get_progress(),
+        segments=segments,
+    )
+    # a digest means the file is in place, a finished resume answers 416
+    if digest is None:
+        raise DownloadError(
+            f"got response code {response.status_code if response is not None else None}"
+        )
 
     if os.name == "posix":
         os.chmod(f"{config['folders']['tools']}/{tool}", 0o744)
@@ -79,6 +90,6 @@ def check_and_download_all_tools():
     check_if_tools_folder_exist()
     for tool in config["tools"]:
         if os.name in tool["os"]:
-            prepare_download_tool(tool["url"], tool["tool"])
+            prepare_download_tool(tool["url"], tool["tool"], tool.get("segments", 1))
             log.info(f"`{tool["tool"]}` downloaded")
     log.info("all tools downloaded")
\ No newline at end of file
@@ -0,0 +1,346 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from rich.progress import Progress, TaskID
+from config import config, log
+
+
+@functools.cache
+def get_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=config["download_workers"],
+        pool_maxsize=config["download_workers"],
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HttpCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                self.validators: dict[str, dict[str, str]] = json.load(file)
+        except (OSError, ValueError):
+            self.validators = {}
+        self.dirty = False
+
+    def headers(self, url: str) -> dict[str, str]:
+        validators = self.validators.get(url, {})
+        headers = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    def update(self, url: str, response: requests.Response) -> None:
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["etag"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["last_modified"] = response.headers["Last-Modified"]
+        with self.lock:
+            if self.validators.get(url) == (validators or None):
+                return
+            if validators:
+                self.validators[url] = validators
+            else:
+                self.validators.pop(url, None)
+            self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(self.validators, file, indent=4)
+            os.replace(f"{self.path}.tmp", self.path)
+            self.dirty = False
+
+
+class HashCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                self.entries: dict[str, dict] = json.load(file)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+
+    def sha256(self, path: str) -> str | None:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        entry = self.entries.get(path)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return entry["sha256"]
+        with open(path, "rb") as file:
+            digest = hashlib.file_digest(file, "sha256").hexdigest()
+        self.record(path, digest)
+        return digest
+
+    def record(self, path: str, sha256: str) -> None:
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        with self.lock:
+            if self.entries.get(path) != entry:
+                self.entries[path] = entry
+                self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(self.entries, file, indent=4)
+            os.replace(f"{self.path}.tmp", self.path)
+            self.dirty = False
+
+
+RETRY_STATUS_CODES = [408, 425, 429, 500, 502, 503, 504]
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+def response_validator(response: requests.Response) -> str | None:
+    etag = response.headers.get("ETag")
+    # If-Range only works with strong etags
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def read_part_meta(part_path: str) -> dict | None:
+    try:
+        with open(f"{part_path}.meta", "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_part_meta(part_path: str, validator: str | None, length: int | None) -> None:
+    with open(f"{part_path}.meta", "w", encoding="utf-8") as file:
+        json.dump({"validator": validator, "length": length}, file)
+
+
+def remove_part(part_path: str) -> None:
+    for path in (part_path, f"{part_path}.meta"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def hash_file(path: str, digest) -> None:
+    with open(path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+
+
+def fetch_part(
+    url: str,
+    part_path: str,
+    headers: dict[str, str],
+    progress: Progress,
+    task_id: TaskID,
+    first: int = 0,
+    last: int | None = None,
+    segment: bool = False,
+) -> tuple[requests.Response | None, str | None]:
+    retries = config["download_retries"]
+    for attempt in range(retries + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        # segments get their If-Range from fetch_segments
+        meta = None if segment else read_part_meta(part_path)
+        if offset and not segment and (meta is None or meta["validator"] is None):
+            # nothing tells whether the leftover belongs to the current version
+            remove_part(part_path)
+            offset = 0
+        if last is not None and first + offset > last:
+            progress.update(task_id, advance=offset)
+            return None, None
+        digest = None if segment else hashlib.sha256()
+        if offset and digest is not None:
+            hash_file(part_path, digest)
+
+        request_headers = dict(headers)
+        if first + offset > 0 or last is not None:
+            request_headers["Range"] = (
+                f"bytes={first + offset}-{'' if last is None else last}"
+            )
+        if offset and meta is not None:
+            # a changed file comes back as a full 200 instead of a 206
+            request_headers["If-Range"] = meta["validator"]
+        try:
+            response = get_session().get(
+                url, stream=True, headers=request_headers, timeout=30
+            )
+            if response.status_code == 416 and offset and last is None:
+                if meta is not None and meta["length"] == offset:
+                    # the partial file already holds the whole body
+                    return response, digest.hexdigest() if digest else None
+                remove_part(part_path)
+                raise DownloadError("partial download doesn't match the file anymore")
+            if response.status_code in RETRY_STATUS_CODES:
+                raise DownloadError(f"got response code {response.status_code}")
+            if response.status_code == 206:
+                mode = "ab"
+            elif response.status_code == 200:
+                if segment:
+                    raise DownloadError("server ignored the range request or the file changed")
+                # no resume support, start over
+                mode = "wb"
+                offset = 0
+                digest = hashlib.sha256()
+            else:
+                return response, None
+
+            length = response.headers.get("content-length")
+            if mode == "wb" and not segment:
+                write_part_meta(
+                    part_path, response_validator(response), int(length) if length else None
+                )
+            if segment:
+                progress.update(task_id, advance=offset)
+            else:
+                progress.update(
+                    task_id,
+                    total=offset + int(length) if length else None,
+                    completed=offset,
+                )
+            with open(part_path, mode) as file:
+                for chunk in response.iter_content(chunk_size=32768):
+                    if digest is not None:
+                        digest.update(chunk)
+                    file.write(chunk)
+                    progress.update(task_id, advance=len(chunk))
+            return response, digest.hexdigest() if digest else None
+        except (requests.exceptions.RequestException, DownloadError) as e:
+            if attempt == retries:
+                raise DownloadError(f"failed to download {url}: {e}") from e
+            delay = min(30.0, 0.5 * 2**attempt)
+            log.warning(f"download of {url} failed ({e}), retrying in {delay:.1f}s")
+            if segment and os.path.exists(part_path):
+                # the retry re-adds everything already on disk
+                progress.update(task_id, advance=-os.path.getsize(part_path))
+            time.sleep(delay)
+    return None, None
+
+
+def fetch_segments(
+    url: str,
+    part_path: str,
+    headers: dict[str, str],
+    progress: Progress,
+    task_id: TaskID,
+    segments: int,
+) -> tuple[requests.Response | None, str | None]:
+    probe = get_session().head(url, headers=headers, allow_redirects=True, timeout=30)
+    length = int(probe.headers.get("content-length") or 0)
+    if (
+        probe.status_code != 200
+        or probe.headers.get("accept-ranges") != "bytes"
+        or length < segments * MIN_SEGMENT_SIZE
+    ):
+        return fetch_part(url, part_path, headers, progress, task_id)
+
+    validator = response_validator(probe)
+    meta = read_part_meta(part_path)
+    if meta is None or meta["validator"] is None or meta != {
+        "validator": validator,
+        "length": length,
+    }:
+        # leftover segments of another version of the file can't be resumed
+        for index in range(segments):
+            if os.path.exists(f"{part_path}.{index}"):
+                os.remove(f"{part_path}.{index}")
+    write_part_meta(part_path, validator, length)
+    if validator is not None:
+        headers = {**headers, "If-Range": validator}
+
+    progress.update(task_id, total=length, completed=0)
+    size = length // segments
+    bounds = [
+        (index * size, length - 1 if index == segments - 1 else (index + 1) * size - 1)
+        for index in range(segments)
+    ]
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [
+            executor.submit(
+                fetch_part,
+                url,
+                f"{part_path}.{index}",
+                headers,
+                progress,
+                task_id,
+                first,
+                last,
+                True,
+            )
+            for index, (first, last) in enumerate(bounds)
+        ]
+        for future in futures:
+            future.result()
+
+    digest = hashlib.sha256()
+    with open(part_path, "wb") as file:
+        for index in range(segments):
+            with open(f"{part_path}.{index}", "rb") as segment:
+                while chunk := segment.read(1024 * 1024):
+                    digest.update(chunk)
+                    file.write(chunk)
+            os.remove(f"{part_path}.{index}")
+    # the joined file is complete, it must not be resumed as a single part
+    write_part_meta(part_path, validator, length)
+    return probe, digest.hexdigest()
+
+
+def download_to_file(
+    url: str,
+    path: str,
+    name: str,
+    progress: Progress,
+    headers: dict[str, str] | None = None,
+    sha256: str | None = None,
+    segments: int = 1,
+) -> tuple[requests.Response | None, str | None]:
+    part_path = f"{path}.part"
+    task_id = progress.add_task(f"download-{name}", total=None, filename=name)
+    try:
+        if segments > 1:
+            response, digest = fetch_segments(
+                url, part_path, headers or {}, progress, task_id, segments
+            )
+        else:
+            response, digest = fetch_part(
+                url, part_path, headers or {}, progress, task_id
+            )
+    finally:
+        progress.remove_task(task_id)
+
+    if digest is None:
+        return response, None
+    if sha256 is not None and digest != sha256.lower():
+        remove_part(part_path)
+        raise DownloadError(f"sha256 mismatch: expected {sha256}, got {digest}")
+    os.replace(part_path, path)
+    remove_part(part_path)
+    return response, digest
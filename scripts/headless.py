@@ -0,0 +1,106 @@
+import json
+import os
+from typing import NotRequired, TypedDict
+from config import config, log
+from scripts.pipeline import BatchResult, load_settings_file, run_batch
+from scripts.utils import list_apks
+
+EXIT_OK = 0
+EXIT_PATCH_FAILED = 2
+EXIT_BUILD_FAILED = 3
+EXIT_INVALID_PROFILE = 4
+EXIT_NO_APKS = 5
+EXIT_SERVICE_UNAVAILABLE = 6
+
+FAILURE_POLICIES = ["skip", "build", "abort"]
+
+
+class RunOptions(TypedDict):
+    apks: NotRequired[list[str]]
+    on_failure: NotRequired[str]
+    jobs: NotRequired[int]
+    result: NotRequired[str]
+
+
+class HeadlessResult(TypedDict):
+    profile: str
+    exit_code: int
+    results: list[BatchResult]
+
+
+def profile_error(run: RunOptions) -> str | None:
+    if run.get("on_failure", "skip") not in FAILURE_POLICIES:
+        return f"profile `on_failure` must be one of {', '.join(FAILURE_POLICIES)}"
+    if not isinstance(run.get("apks", []), list):
+        return "profile `apks` must be a list of apk file names"
+    return None
+
+
+def split_profile(profile: dict) -> tuple[RunOptions, dict]:
+    # "run" is reserved, everything else is the usual settings file format
+    settings = dict(profile)
+    run: RunOptions = settings.pop("run", {})
+    return run, settings
+
+
+def load_profile(path: str) -> tuple[RunOptions, dict]:
+    try:
+        profile = load_settings_file(path)
+    except (OSError, ValueError) as e:
+        log.error(f"can't read profile `{path}`: {e}")
+        exit(EXIT_INVALID_PROFILE)
+
+    run, settings = split_profile(profile)
+    error = profile_error(run)
+    if error:
+        log.error(error)
+        exit(EXIT_INVALID_PROFILE)
+    for repo_uuid in settings:
+        if not any(repo["uuid"] == repo_uuid for repo in config["repositories"]):
+            log.warning(f"profile has settings for unknown repository `{repo_uuid}`")
+    return run, settings
+
+
+def results_exit_code(results: list[BatchResult]) -> int:
+    statuses = [result["status"] for result in results]
+    if "failed" in statuses:
+        return EXIT_BUILD_FAILED
+    if any(status != "ok" for status in statuses):
+        return EXIT_PATCH_FAILED
+    return EXIT_OK
+
+
+def run_headless(path: str, jobs: int) -> int:
+    run, settings = load_profile(path)
+    apks = run.get("apks") or list_apks()
+    if not apks:
+        log.error("no apks to patch")
+        return EXIT_NO_APKS
+    missing = [
+        apk for apk in apks if not os.path.isfile(f"{config['folders']['apks']}/{apk}")
+    ]
+    if missing:
+        log.error(f"apks not found in `{config['folders']['apks']}`: {', '.join(missing)}")
+        return EXIT_INVALID_PROFILE
+
+    on_failure = run.get("on_failure", "skip")
+    results = run_batch(
+        apks,
+        settings,
+        run.get("jobs", jobs),
+        build_on_failure=on_failure == "build",
+        abort_on_failure=on_failure == "abort",
+    )
+
+    exit_code = results_exit_code(results)
+    result_path = run.get("result") or os.path.join(config["folders"]["out"], "result.json")
+    os.makedirs(os.path.dirname(result_path) or ".", exist_ok=True)
+    headless_result: HeadlessResult = {
+        "profile": path,
+        "exit_code": exit_code,
+        "results": results,
+    }
+    with open(result_path, "w", encoding="utf-8") as file:
+        json.dump(headless_result, file, indent=4, ensure_ascii=False)
+    log.info(f"result written to {result_path}")
+    return exit_code
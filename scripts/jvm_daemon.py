@@ -0,0 +1,82 @@
+import atexit
+import os
+import subprocess
+import threading
+from config import log
+from scripts.profiler import profiler
+
+JAR_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "JarRunner.java")
+
+
+class JvmDaemon:
+    def __init__(self):
+        self.process: subprocess.Popen | None = None
+        self.available = True
+        self.lock = threading.Lock()
+
+    def _spawn(self, flags: list[str]) -> bool:
+        try:
+            self.process = subprocess.Popen(
+                ["java", *flags, JAR_RUNNER],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+            )
+        except OSError as e:
+            log.warning(f"failed to start jvm daemon: {e}")
+            return False
+
+        ready = self.process.stdout.readline().split()
+        if ready == ["READY", "guarded"]:
+            return True
+        self.stop()
+        if ready == ["READY", "unguarded"]:
+            log.warning("jvm daemon can't intercept System.exit on this java")
+        return False
+
+    def start(self) -> bool:
+        if self.process is not None:
+            return True
+        if not self.available:
+            return False
+
+        # `allow` is required on java 18+ and rejected before java 12
+        self.available = self._spawn(["-Djava.security.manager=allow"]) or self._spawn([])
+        if self.available:
+            log.info("jvm daemon started")
+        else:
+            log.warning("jvm daemon is not available, falling back to `java -jar`")
+        return self.available
+
+    def run(self, jar: str, jar_args: list[str]) -> int | None:
+        profiler.mark_external()
+        with self.lock:
+            if not self.start():
+                return None
+            try:
+                self.process.stdin.write("\t".join([jar, *jar_args]) + "\n")
+                self.process.stdin.flush()
+                reply = self.process.stdout.readline().split()
+            except OSError:
+                reply = []
+            if len(reply) != 2 or reply[0] != "DONE":
+                log.error("jvm daemon died while running a job")
+                self.stop()
+                self.available = False
+                return None
+            return int(reply[1])
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+
+
+jvm_daemon = JvmDaemon()
+atexit.register(jvm_daemon.stop)
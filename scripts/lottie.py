@@ -0,0 +1,193 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from scripts.worktree import detach_file
+
+Color = tuple[float, float, float]
+ColorMap = list[tuple[Color, Color]]
+
+NUMBER = rb"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?"
+COLOR_ARRAY = re.compile(
+    rb"\[\s*(" + NUMBER + rb")\s*,\s*(" + NUMBER + rb")\s*,\s*(" + NUMBER + rb")\s*(?:,\s*" + NUMBER + rb"\s*)?\]"
+)
+SOLID_COLOR = re.compile(rb'"sc"\s*:\s*"(#[0-9a-fA-F]{6,8})"')
+# half of an 8 bit step, colors that round to the same hex value match
+DEFAULT_ATOL = 0.5 / 255
+
+
+def parse_hex_color(hex_color: str) -> Color:
+    hex_color = hex_color.lstrip("#")
+    if len(hex_color) == 8:
+        # android style #AARRGGBB, lottie keeps opacity separately
+        hex_color = hex_color[2:]
+    if len(hex_color) != 6:
+        raise ValueError(f"not a #RRGGBB or #AARRGGBB color: {hex_color}")
+    return (
+        int(hex_color[:2], 16) / 255.0,
+        int(hex_color[2:4], 16) / 255.0,
+        int(hex_color[4:6], 16) / 255.0,
+    )
+
+
+def color_to_hex(color: Color) -> str:
+    return "#" + "".join(f"{round(channel * 255):02x}" for channel in color)
+
+
+def make_color_map(colors: dict[str, str]) -> ColorMap:
+    return [(parse_hex_color(src), parse_hex_color(dst)) for src, dst in colors.items()]
+
+
+def isclose(a: float, b: float, rtol: float, atol: float) -> bool:
+    # same formula as numpy.isclose, b is the reference value
+    return abs(a - b) <= atol + rtol * abs(b)
+
+
+def match_color(
+    color: list | tuple, color_map: ColorMap, rtol: float, atol: float
+) -> Color | None:
+    for src, dst in color_map:
+        if all(isclose(color[i], src[i], rtol, atol) for i in range(3)):
+            return dst
+    return None
+
+
+def has_candidate(data: bytes, color_map: ColorMap, rtol: float, atol: float) -> bool:
+    for match in COLOR_ARRAY.finditer(data):
+        if match_color([float(group) for group in match.groups()], color_map, rtol, atol):
+            return True
+    for match in SOLID_COLOR.finditer(data):
+        if match_color(parse_hex_color(match.group(1).decode()), color_map, rtol, atol):
+            return True
+    return False
+
+
+def recolor_array(value: list, color_map: ColorMap, rtol: float, atol: float) -> int:
+    if not 3 <= len(value) <= 4 or not all(isinstance(x, (int, float)) for x in value):
+        return 0
+    dst = match_color(value, color_map, rtol, atol)
+    if dst is None:
+        return 0
+    value[:3] = dst
+    return 1
+
+
+def recolor_property(prop: dict, color_map: ColorMap, rtol: float, atol: float) -> int:
+    value = prop.get("k")
+    if not isinstance(value, list) or not value:
+        return 0
+    if not isinstance(value[0], dict):
+        return recolor_array(value, color_map, rtol, atol)
+    changed = 0
+    for keyframe in value:
+        for key in ("s", "e"):
+            if isinstance(keyframe.get(key), list):
+                changed += recolor_array(keyframe[key], color_map, rtol, atol)
+    return changed
+
+
+def recolor_node(node, color_map: ColorMap, rtol: float, atol: float) -> int:
+    changed = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(child for child in node if isinstance(child, (dict, list)))
+            continue
+        if not isinstance(node, dict):
+            continue
+        for key, value in node.items():
+            # fill and stroke colors are "c", solid layers carry a hex string
+            if key == "c" and isinstance(value, dict):
+                changed += recolor_property(value, color_map, rtol, atol)
+            elif key == "sc" and isinstance(value, str):
+                try:
+                    dst = match_color(parse_hex_color(value), color_map, rtol, atol)
+                except ValueError:
+                    dst = None
+                if dst is not None:
+                    node[key] = color_to_hex(dst)
+                    changed += 1
+            elif isinstance(value, (dict, list)):
+                stack.append(value)
+    return changed
+
+
+def recolor_lottie_file(
+    file: str, color_map: ColorMap, rtol: float = 0.0, atol: float = DEFAULT_ATOL
+) -> int:
+    with open(file, "rb") as f:
+        data = f.read()
+    if not has_candidate(data, color_map, rtol, atol):
+        return 0
+    try:
+        animation = json.loads(data)
+    except ValueError:
+        return 0
+    if not isinstance(animation, dict) or "layers" not in animation:
+        return 0
+
+    changed = recolor_node(animation, color_map, rtol, atol)
+    if changed:
+        detach_file(file)
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump(animation, f, ensure_ascii=False, separators=(",", ":"))
+    return changed
+
+
+def _recolor_lottie_shard(
+    files: list[str], color_map: ColorMap, rtol: float, atol: float
+) -> dict[str, int]:
+    changed = {}
+    for file in files:
+        count = recolor_lottie_file(file, color_map, rtol, atol)
+        if count:
+            changed[file] = count
+    return changed
+
+
+def list_lottie_files(roots: list[str]) -> list[str]:
+    files = []
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    files.append(os.path.join(dirpath, filename))
+    files.sort()
+    return files
+
+
+def recolor_lottie(
+    colors: dict[str, str],
+    roots: list[str] | None = None,
+    rtol: float = 0.0,
+    atol: float = DEFAULT_ATOL,
+    workers: int | None = None,
+) -> dict[str, int]:
+    if roots is None:
+        from config import config
+
+        roots = [
+            os.path.join(config["folders"]["decompiled"], "res", "raw"),
+            os.path.join(config["folders"]["decompiled"], "assets"),
+        ]
+
+    color_map = make_color_map(colors)
+    files = list_lottie_files(roots)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(files) < 32:
+        return _recolor_lottie_shard(files, color_map, rtol, atol)
+
+    shard_count = workers * 4
+    shards = [files[i::shard_count] for i in range(shard_count)]
+    changed: dict[str, int] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in executor.map(
+            _recolor_lottie_shard,
+            shards,
+            [color_map] * shard_count,
+            [rtol] * shard_count,
+            [atol] * shard_count,
+        ):
+            changed.update(shard)
+    return dict(sorted(changed.items()))
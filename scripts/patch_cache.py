@@ -0,0 +1,176 @@
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+from config import config, log
+from repo_types import PatchMetaData
+from scripts.patch_scheduler import glob_prefix
+from scripts.worktree import WORKTREE_MARKER
+
+IGNORED_TOP = ["build", "dist", WORKTREE_MARKER]
+
+
+def patch_chain_key(previous: str, patch: PatchMetaData, seed: str) -> str:
+    digest = hashlib.sha256()
+    for part in [
+        previous,
+        seed,
+        patch["uuid"],
+        patch.get("sha256", ""),
+        json.dumps(patch.get("settings"), sort_keys=True, ensure_ascii=False),
+    ]:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def snapshot_files(root: str, patterns: list[str] | None) -> dict[str, tuple]:
+    bases = [""]
+    if patterns is not None:
+        bases = sorted({os.path.dirname(glob_prefix(pattern)) for pattern in patterns})
+    snapshot = {}
+    for base in bases:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, base)):
+            relpath = os.path.relpath(dirpath, root)
+            relpath = "" if relpath == "." else relpath.replace(os.sep, "/")
+            if relpath == "":
+                dirnames[:] = [name for name in dirnames if name not in IGNORED_TOP]
+            for name in filenames:
+                path = f"{relpath}/{name}" if relpath else name
+                if path in IGNORED_TOP:
+                    continue
+                if patterns is not None and not any(
+                    fnmatch.fnmatch(path, pattern) for pattern in patterns
+                ):
+                    continue
+                stat = os.stat(os.path.join(dirpath, name))
+                snapshot[path] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+class PatchCache:
+    def __init__(self):
+        self.root = os.path.join(config["folders"]["cache"], "patches")
+        self.objects = os.path.join(self.root, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(os.path.join(self.root, "entries"), exist_ok=True)
+        self.used: set[str] = set()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.root, "entries", f"{key}.json")
+
+    def lookup(self, key: str) -> dict | None:
+        try:
+            with open(self.entry_path(key), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        # another process may have evicted objects the entry needs
+        for sha256 in entry["files"].values():
+            if sha256 is not None and not os.path.exists(
+                os.path.join(self.objects, sha256)
+            ):
+                return None
+        return entry
+
+    def save_entry(self, key: str, entry: dict) -> None:
+        entry["last_used"] = time.time()
+        with open(f"{self.entry_path(key)}.tmp", "w", encoding="utf-8") as file:
+            json.dump(entry, file, indent=4)
+        os.replace(f"{self.entry_path(key)}.tmp", self.entry_path(key))
+
+    def replay(self, entry: dict) -> None:
+        decompiled = config["folders"]["decompiled"]
+        for path, sha256 in entry["files"].items():
+            target = os.path.join(decompiled, *path.split("/"))
+            if sha256 is None:
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # replacing the path also breaks a hardlink to the pristine tree
+            shutil.copyfile(os.path.join(self.objects, sha256), f"{target}.replay")
+            os.replace(f"{target}.replay", target)
+
+    def store(
+        self, key: str, before: dict[str, tuple], after: dict[str, tuple], status: bool
+    ) -> None:
+        decompiled = config["folders"]["decompiled"]
+        files = {path: None for path in before if path not in after}
+        for path, stat in after.items():
+            if before.get(path) == stat:
+                continue
+            with open(os.path.join(decompiled, *path.split("/")), "rb") as file:
+                sha256 = hashlib.file_digest(file, "sha256").hexdigest()
+            if not os.path.exists(os.path.join(self.objects, sha256)):
+                shutil.copyfile(
+                    os.path.join(decompiled, *path.split("/")),
+                    os.path.join(self.objects, f"{sha256}.tmp"),
+                )
+                os.replace(
+                    os.path.join(self.objects, f"{sha256}.tmp"),
+                    os.path.join(self.objects, sha256),
+                )
+            files[path] = sha256
+
+        self.save_entry(key, {"status": status, "files": files})
+
+    def evict(self) -> None:
+        # entries share objects, an object goes when no entry refers to it anymore
+        limit = config["patch_cache_size_mb"] * 1024 * 1024
+        entries = []
+        references: dict[str, int] = {}
+        for name in os.listdir(os.path.join(self.root, "entries")):
+            key = name.removesuffix(".json")
+            if not name.endswith(".json"):
+                continue
+            entry = self.lookup(key)
+            files = [] if entry is None else [
+                sha256 for sha256 in entry["files"].values() if sha256 is not None
+            ]
+            for sha256 in files:
+                references[sha256] = references.get(sha256, 0) + 1
+            if key not in self.used:
+                last_used = entry.get("last_used", 0) if entry else 0
+                entries.append((last_used, key, files))
+
+        sizes = {
+            name: os.path.getsize(os.path.join(self.objects, name))
+            for name in os.listdir(self.objects)
+            if not name.endswith(".tmp")
+        }
+        total = sum(size for name, size in sizes.items() if name in references)
+        evicted = 0
+        for _, key, files in sorted(entries):
+            if total <= limit:
+                break
+            os.remove(self.entry_path(key))
+            evicted += 1
+            for sha256 in files:
+                references[sha256] -= 1
+                if references[sha256] == 0:
+                    total -= sizes.get(sha256, 0)
+
+        for name in sizes:
+            if references.get(name, 0) == 0:
+                os.remove(os.path.join(self.objects, name))
+        if evicted:
+            log.info(f"evicted {evicted} patch cache entries")
+
+    def apply(self, key: str, patch: PatchMetaData, run) -> bool:
+        self.used.add(key)
+        entry = self.lookup(key)
+        if entry is not None:
+            log.info(f"patch `{patch['title']}` replayed from cache")
+            self.replay(entry)
+            self.save_entry(key, entry)
+            return entry["status"]
+
+        decompiled = config["folders"]["decompiled"]
+        patterns = patch.get("writes")
+        before = snapshot_files(decompiled, patterns)
+        status = run()
+        self.store(key, before, snapshot_files(decompiled, patterns), status)
+        return status
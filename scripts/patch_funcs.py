@@ -1,10 +1,16 @@
+import functools
+import hashlib
 import importlib
 import json
+import sys
 from typing import TypedDict
 from repo_types import PatchMetaData, RepoManifest
 from config import config, log, args, console
-from beaupy import select_multiple
-from rich.progress import BarColumn, Progress, TextColumn
+from scripts.patch_cache import PatchCache, patch_chain_key
+from scripts.patch_scheduler import order_patches, run_patch_graph
+from scripts.profiler import profiler
+from scripts.registry import registry
+from scripts.smali_index import SmaliIndex
 import os
 import textwrap
 
@@ -30,22 +36,11 @@ class Patch:
 
 
 def get_patch_list_from_repo(repo_uuid: str) -> list[PatchMetaData]:
-    manifest_patches = json.load(
-        open(
-            f"repos/{repo_uuid.replace("-", "_")}/manifest.json",
-            "r",
-            encoding="utf-8",
-        )
-    )["patches"]
-    patch_files = os.listdir(f"repos/{repo_uuid.replace('-', '_')}/patches") or []
-    existing_patches = [p for p in manifest_patches if p["filename"] in patch_files]
-    return sorted(existing_patches, key=lambda x: x["title"])
+    return registry.patches(repo_uuid)
 
 
 def find_patch_in_repo(repo_uuid: str, title: str) -> PatchMetaData:
-    return next(
-        (p for p in get_patch_list_from_repo(repo_uuid) if p["title"] == title), None
-    )
+    return registry.find_by_title(repo_uuid, title)
 
 
 def sort_patches_by_priority(patches: list[PatchMetaData]) -> list[PatchMetaData]:
@@ -55,6 +50,8 @@ def sort_patches_by_priority(patches: list[PatchMetaData]) -> list[PatchMetaData
 
 
 def select_patches_from_repo(repo_uuid: str) -> list[PatchMetaData]:
+    from beaupy import select_multiple
+
     return select_multiple(
         get_patch_list_from_repo(repo_uuid),
         preprocessor=lambda x: x["title"],
@@ -62,12 +59,16 @@ def select_patches_from_repo(repo_uuid: str) -> list[PatchMetaData]:
     )
 
 
-progress = Progress(
-    "[progress.description]{task.description}",
-    TextColumn(text_format="{task.fields[patch]}"),
-    BarColumn(bar_width=None),
-    "[blue]{task.completed}/{task.total}",
-)
+@functools.cache
+def get_progress():
+    from rich.progress import BarColumn, Progress, TextColumn
+
+    return Progress(
+        "[progress.description]{task.description}",
+        TextColumn(text_format="{task.fields[patch]}"),
+        BarColumn(bar_width=None),
+        "[blue]{task.completed}/{task.total}",
+    )
 
 
 class PatchStatus(TypedDict):
@@ -88,19 +89,34 @@ class PatchGlobals(TypedDict):
         str, dict[str, dict]
     ]  # repo_uuid: {patch_uuid: {setting: value}}
     resource_path: str
+    smali_index: SmaliIndex
+    patch_chain_key: str | None
+
+
+# repository stamp at the time its patch modules were imported
+imported_repo_stamps: dict[str, tuple] = {}
+
+
+def refresh_repo_modules(repo_uuid: str) -> None:
+    # long-lived processes (the build service) would keep running old patch
+    # code after --repo-update, drop the modules once the repository changes
+    package = f"repos.{repo_uuid.replace('-', '_')}"
+    stamp = registry.get(repo_uuid).stamp
+    if imported_repo_stamps.get(repo_uuid, stamp) != stamp:
+        for name in list(sys.modules):
+            if name == package or name.startswith(f"{package}."):
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    imported_repo_stamps[repo_uuid] = stamp
 
 
 def apply_patches_from_repo(
     repo_uuid: str, patches: list[PatchMetaData], globals: PatchGlobals
 ) -> tuple[RepoManifest, list[PatchStatus]]:
-    statuses: list[PatchStatus] = []
-    patches = sort_patches_by_priority(patches)
+    # copies, the registry's cached metadata must not pick up settings overrides
+    patches = [dict(patch) for patch in sort_patches_by_priority(patches)]
 
-    manifest: RepoManifest = json.load(
-        open(
-            f"repos/{repo_uuid.replace("-", "_")}/manifest.json", "r", encoding="utf-8"
-        )
-    )
+    manifest: RepoManifest = registry.manifest(repo_uuid)
     globals["resource_path"] = f"repos/{repo_uuid.replace('-', '_')}/resources"
 
     if globals["settings_override"]:
@@ -113,33 +129,85 @@ def apply_patches_from_repo(
                     patch["uuid"]
                 ]["priority"]
 
+    patches = order_patches(patches)
     globals["patches_enabled"].extend(patches)
+    refresh_repo_modules(repo_uuid)
+    modules = {
+        patch["uuid"]: importlib.import_module(
+            f"repos.{repo_uuid.replace("-", "_")}.patches.{patch['filename'][:-3]}"
+        )
+        for patch in patches
+    }
+    first_status = len(globals["patches_statuses"])
+
+    # a patch's cache key covers everything applied before it, across repos too
+    patch_cache = PatchCache() if globals["patch_chain_key"] else None
+    chain_keys = {}
+    if patch_cache is not None:
+        seed = hashlib.sha256(
+            json.dumps(manifest["resources"], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        for patch in patches:
+            globals["patch_chain_key"] = patch_chain_key(
+                globals["patch_chain_key"], patch, seed
+            )
+            chain_keys[patch["uuid"]] = globals["patch_chain_key"]
+
+    progress = get_progress()
     with progress:
         task = progress.add_task(
             f"applying patches from {manifest['repo']['title']}:",
             total=len(patches),
             patch="",
         )
-        for patch in patches:
+
+        def apply(patch: PatchMetaData) -> bool:
             progress.update(task, patch=patch["title"])
-            module = importlib.import_module(
-                f"repos.{repo_uuid.replace("-", "_")}.patches.{patch['filename'][:-3]}"
-            )
-            status = module.apply(patch["settings"], globals)
-            statuses.append(
-                {"name": patch["title"], "uuid": patch["uuid"], "status": status}
-            )
+            with profiler.stage(patch["title"], "patch"):
+                if patch_cache is None:
+                    return modules[patch["uuid"]].apply(patch["settings"], globals)
+                return patch_cache.apply(
+                    chain_keys[patch["uuid"]],
+                    patch,
+                    lambda: modules[patch["uuid"]].apply(patch["settings"], globals),
+                )
+
+        def on_done(patch: PatchMetaData, status: bool) -> None:
             globals["patches_statuses"].append(
                 {"name": patch["title"], "uuid": patch["uuid"], "status": status}
             )
             progress.update(task, advance=1)
 
+        results = run_patch_graph(patches, apply, on_done, config["patch_workers"])
         progress.update(task, description="patches applied", patch="")
+    if patch_cache is not None:
+        patch_cache.evict()
+
+    statuses: list[PatchStatus] = [
+        {"name": patch["title"], "uuid": patch["uuid"], "status": status}
+        for patch, status in zip(patches, results)
+    ]
+    # completion order varies between runs, keep the recorded order stable
+    globals["patches_statuses"][first_status:] = statuses
 
     return manifest, statuses
 
 
-def select_and_apply_patches(globals: PatchGlobals) -> list[PatchStatus]:
+def select_patches_from_settings(
+    repo_uuid: str, settings_override: dict
+) -> list[PatchMetaData]:
+    repo_settings = settings_override.get(repo_uuid, {}).get("settings", {})
+    return [
+        patch
+        for patch in get_patch_list_from_repo(repo_uuid)
+        if patch["uuid"] in repo_settings
+        and repo_settings[patch["uuid"]].get("enabled", True)
+    ]
+
+
+def select_and_apply_patches(
+    globals: PatchGlobals, from_settings: bool = False
+) -> list[PatchStatus]:
     toApply: dict[str, list[PatchMetaData]] = {}
     statuses = []
 
@@ -148,7 +216,12 @@ def select_and_apply_patches(globals: PatchGlobals) -> list[PatchStatus]:
             f"repos/{repo['uuid'].replace("-", "_")}/patches/__init__.py"
         ):
             continue
-        patches = select_patches_from_repo(repo["uuid"])
+        if from_settings:
+            patches = select_patches_from_settings(
+                repo["uuid"], globals["settings_override"]
+            )
+        else:
+            patches = select_patches_from_repo(repo["uuid"])
         if len(patches) == 0:
             continue
         toApply[repo["uuid"]] = patches
@@ -231,6 +304,7 @@ def generate_settings_file():
                 "title": patch["title"],
                 "filename": patch["filename"],
                 "priority": patch["priority"],
+                "enabled": True,
                 "settings": patch["settings"],
             }
     with open(args.settings_file or "settings.json", "w") as f:
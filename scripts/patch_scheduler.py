@@ -0,0 +1,139 @@
+import heapq
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable
+from config import log
+from repo_types import PatchMetaData
+
+GLOB_CHARS = "*?["
+
+
+def glob_prefix(pattern: str) -> str:
+    for index, char in enumerate(pattern):
+        if char in GLOB_CHARS:
+            return pattern[:index]
+    return pattern
+
+
+def globs_overlap(a: str, b: str) -> bool:
+    # conservative: two globs may overlap when one literal prefix extends the other
+    a_prefix, b_prefix = glob_prefix(a), glob_prefix(b)
+    if a_prefix == a and b_prefix == b:
+        return a == b
+    return a_prefix.startswith(b_prefix) or b_prefix.startswith(a_prefix)
+
+
+def patches_conflict(a: PatchMetaData, b: PatchMetaData) -> bool:
+    # a patch that doesn't declare what it writes may touch anything
+    if "writes" not in a or "writes" not in b:
+        return True
+    a_touches = a["writes"] + a.get("reads", [])
+    b_touches = b["writes"] + b.get("reads", [])
+    return any(globs_overlap(w, t) for w in a["writes"] for t in b_touches) or any(
+        globs_overlap(w, t) for w in b["writes"] for t in a_touches
+    )
+
+
+def writes_conflict(a: PatchMetaData, b: PatchMetaData) -> bool:
+    if a["uuid"] in b.get("depends", []) or b["uuid"] in a.get("depends", []):
+        return False
+    return any(
+        globs_overlap(x, y) for x in a.get("writes", []) for y in b.get("writes", [])
+    )
+
+
+def order_patches(patches: list[PatchMetaData]) -> list[PatchMetaData]:
+    index = {patch["uuid"]: position for position, patch in enumerate(patches)}
+    dependents: dict[int, list[int]] = {position: [] for position in index.values()}
+    missing = [0] * len(patches)
+    for position, patch in enumerate(patches):
+        for dependency in patch.get("depends", []):
+            if dependency not in index:
+                log.warning(
+                    f"patch `{patch['title']}` depends on `{dependency}`, which is not enabled"
+                )
+                continue
+            dependents[index[dependency]].append(position)
+            missing[position] += 1
+
+    # topological order, ties keep the priority order
+    ready = [position for position in range(len(patches)) if missing[position] == 0]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        position = heapq.heappop(ready)
+        ordered.append(patches[position])
+        for dependent in dependents[position]:
+            missing[dependent] -= 1
+            if missing[dependent] == 0:
+                heapq.heappush(ready, dependent)
+
+    if len(ordered) != len(patches):
+        cycle = [patches[p]["title"] for p in range(len(patches)) if missing[p]]
+        log.error(f"patch dependency cycle between {cycle}, using priority order")
+        return patches
+    return ordered
+
+
+def build_patch_graph(patches: list[PatchMetaData]) -> list[set[int]]:
+    index = {patch["uuid"]: position for position, patch in enumerate(patches)}
+    predecessors: list[set[int]] = [set() for _ in patches]
+    for position, patch in enumerate(patches):
+        for earlier in range(position):
+            if patches_conflict(patches[earlier], patch):
+                predecessors[position].add(earlier)
+                if writes_conflict(patches[earlier], patch):
+                    log.warning(
+                        f"patches `{patches[earlier]['title']}` and `{patch['title']}` write the same files, applying them in priority order"
+                    )
+        for dependency in patch.get("depends", []):
+            if index.get(dependency, position) < position:
+                predecessors[position].add(index[dependency])
+    return predecessors
+
+
+def run_patch_graph(
+    patches: list[PatchMetaData],
+    apply: Callable[[PatchMetaData], Any],
+    on_done: Callable[[PatchMetaData, Any], None],
+    workers: int,
+) -> list[Any]:
+    predecessors = build_patch_graph(patches)
+    index = {patch["uuid"]: position for position, patch in enumerate(patches)}
+    results: list[Any] = [None] * len(patches)
+    done: set[int] = set()
+    started: set[int] = set()
+    running: dict[Future, int] = {}
+
+    def failed_dependency(position: int) -> str | None:
+        for dependency in patches[position].get("depends", []):
+            if dependency in index and results[index[dependency]] is False:
+                return patches[index[dependency]]["title"]
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while len(done) < len(patches):
+            # submit in list order so the schedule only depends on the graph
+            for position in range(len(patches)):
+                if position in started or not predecessors[position] <= done:
+                    continue
+                started.add(position)
+                dependency = failed_dependency(position)
+                if dependency is not None:
+                    log.error(
+                        f"skipping patch `{patches[position]['title']}`, its dependency `{dependency}` failed"
+                    )
+                    results[position] = False
+                    done.add(position)
+                    on_done(patches[position], False)
+                    continue
+                running[executor.submit(apply, patches[position])] = position
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                position = running.pop(future)
+                results[position] = future.result()
+                done.add(position)
+                on_done(patches[position], results[position])
+    return results
@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor, as_completed
+from typing import TypedDict
+from config import args, config, log, console
+from scripts.build_cache import prepare_incremental_build, store_build_outputs
+from scripts.decompile_cache import restore_decompiled
+from scripts.patch_funcs import PatchGlobals, PatchStatus, select_and_apply_patches
+from scripts.profiler import profiler
+from scripts.smali_index import SmaliIndex
+from scripts.worktree import read_worktree_marker
+from scripts.utils import (
+    compile_apk,
+    decompile_apk,
+    read_apktool_yml,
+    sign_apk,
+)
+
+
+class BatchResult(TypedDict):
+    apk: str
+    version: str
+    patches_applied: int
+    patches_total: int
+    status: str
+    output: str | None
+    seconds: float
+    patches: list[PatchStatus]
+
+
+def prepare_decompiled(apk_path: str) -> None:
+    if args.no_decompile:
+        return
+    log.info("Decompile APK")
+    with profiler.stage("decompile"):
+        if args.no_cache:
+            decompile_apk(apk_path)
+        else:
+            restore_decompiled(apk_path)
+
+
+def initial_patch_chain_key() -> str | None:
+    # a --no-decompile tree may already carry patches, the chain would lie
+    if not args.patch_cache or args.no_decompile:
+        return None
+    marker = read_worktree_marker(config["folders"]["decompiled"])
+    if marker is None:
+        log.warning("patch cache needs a working tree from the decompile cache, disabled")
+        return None
+    return os.path.basename(marker["pristine"])
+
+
+def make_patch_globals(apk: str, settings_override: dict | None) -> PatchGlobals:
+    versionName, versionCode, sdkMin, sdkMax = read_apktool_yml()
+    return {
+        "apk": apk,
+        "app_version_name": versionName,
+        "app_version_code": versionCode,
+        "app_sdk_version_min": sdkMin,
+        "app_sdk_version_max": sdkMax,
+        "patches_enabled": [],
+        "patches_statuses": [],
+        "settings_override": settings_override,
+        # built or loaded on the first query, most runs never ask
+        "smali_index": SmaliIndex(
+            config["folders"]["decompiled"], f"{config['folders']['apks']}/{apk}"
+        ),
+        "patch_chain_key": initial_patch_chain_key(),
+    }
+
+
+def build_patched_apk(apk: str) -> str:
+    newApk = apk.removesuffix(".apk") + "-patched.apk"
+    log.info("Compile APK")
+    with profiler.stage("compile"):
+        incremental = prepare_incremental_build() if args.incremental else None
+        compile_apk(f"{config['folders']['out']}/{newApk}", force=incremental is None)
+        if incremental:
+            store_build_outputs(*incremental)
+    log.info("Zipalign and Sign APK")
+    sign_apk(f"{config['folders']['out']}/{newApk}")
+    return f"{config['folders']['out']}/{newApk.removesuffix('.apk')}-aligned-signed.apk"
+
+
+def load_settings_file(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as file:
+        return json.loads(file.read())
+
+
+def batch_folders(apk: str) -> tuple[str, str]:
+    name = apk.removesuffix(".apk")
+    return (
+        f"{config['folders']['decompiled']}-{name}",
+        os.path.join(config["folders"]["out"], name),
+    )
+
+
+def run_batch_job(
+    apk: str,
+    settings_override: dict,
+    decompiled: str,
+    out: str,
+    build_on_failure: bool = False,
+) -> BatchResult:
+    start = time.perf_counter()
+    # every job gets its own working tree and output folder
+    config["folders"]["decompiled"], config["folders"]["out"] = decompiled, out
+    result: BatchResult = {
+        "apk": apk,
+        "version": "",
+        "patches_applied": 0,
+        "patches_total": 0,
+        "status": "ok",
+        "output": None,
+        "seconds": 0.0,
+        "patches": [],
+    }
+
+    prepare_decompiled(f"{config['folders']['apks']}/{apk}")
+    globals = make_patch_globals(apk, settings_override)
+    result["version"] = f"{globals['app_version_name']} ({globals['app_version_code']})"
+
+    statuses: list[PatchStatus] = select_and_apply_patches(globals, from_settings=True)
+    result["patches"] = statuses
+    result["patches_total"] = len(statuses)
+    result["patches_applied"] = sum(1 for status in statuses if status["status"])
+
+    if result["patches_applied"] != result["patches_total"]:
+        result["status"] = "partial" if build_on_failure else "patch failed"
+    if result["status"] != "patch failed" and not args.no_compile:
+        shutil.rmtree(config["folders"]["out"], ignore_errors=True)
+        os.makedirs(config["folders"]["out"])
+        result["output"] = build_patched_apk(apk)
+
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(
+    apks: list[str],
+    settings_override: dict,
+    jobs: int,
+    build_on_failure: bool = False,
+    abort_on_failure: bool = False,
+) -> list[BatchResult]:
+    results: list[BatchResult] = []
+    log.info(f"batch: {len(apks)} apks, {jobs} workers")
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                run_batch_job,
+                apk,
+                settings_override,
+                *batch_folders(apk),
+                build_on_failure,
+            ): apk
+            for apk in apks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except BaseException as e:
+                status = "cancelled" if isinstance(e, CancelledError) else "failed"
+                if status == "failed":
+                    # run_cmd exits on a failed tool, that surfaces here as SystemExit
+                    log.error(f"batch job `{futures[future]}` failed: {e!r}")
+                result = {
+                    "apk": futures[future],
+                    "version": "",
+                    "patches_applied": 0,
+                    "patches_total": 0,
+                    "status": status,
+                    "output": None,
+                    "seconds": 0.0,
+                    "patches": [],
+                }
+            log.info(f"batch job `{result['apk']}` finished: {result['status']}")
+            results.append(result)
+            if abort_on_failure and result["status"] not in ("ok", "cancelled"):
+                # jobs already handed to a worker finish, the rest come back cancelled
+                for pending in futures:
+                    pending.cancel()
+    return sorted(results, key=lambda result: apks.index(result["apk"]))
+
+
+def print_batch_summary(results: list[BatchResult]) -> None:
+    from rich.table import Table
+
+    table = Table(title="batch summary")
+    table.add_column("APK")
+    table.add_column("VERSION")
+    table.add_column("PATCHES", justify="right")
+    table.add_column("STATUS")
+    table.add_column("TIME", justify="right")
+    table.add_column("OUTPUT")
+    for result in results:
+        table.add_row(
+            result["apk"],
+            result["version"],
+            f"{result['patches_applied']}/{result['patches_total']}",
+            (
+                f"[green]{result['status']}"
+                if result["status"] == "ok"
+                else f"[red]{result['status']}"
+            ),
+            f"{result['seconds']:.1f}s",
+            result["output"] or "",
+        )
+    console.print(table)
@@ -0,0 +1,212 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import TypedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+
+class StageRecord(TypedDict):
+    name: str
+    category: str
+    thread: int
+    start: float
+    wall: float
+    cpu: float
+    children_cpu: float
+    rss_delta_kb: int | None
+    process_peak_rss_kb: int | None
+    children_process_peak_rss_kb: int | None
+    files_read: int | None
+    files_written: int | None
+    bytes_written: int | None
+
+
+class ActiveStage:
+    def __init__(self):
+        self.read: set[str] = set()
+        self.written: set[str] = set()
+        self.external = False
+
+
+def current_rss_kb() -> int | None:
+    # resident pages are the second field, only linux has it
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def peak_rss_kb(who) -> int | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # bytes on macos, kilobytes everywhere else
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.records: list[StageRecord] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.threads: dict[int, int] = {}
+        self.origin = time.perf_counter()
+
+    def enable(self, report_path: str | None, trace_path: str | None) -> None:
+        if self.enabled:
+            return
+        self.enabled = True
+        self.origin = time.perf_counter()
+        sys.addaudithook(self.audit)
+        atexit.register(self.write, report_path, trace_path)
+
+    def active_stages(self) -> list[ActiveStage]:
+        if not hasattr(self.local, "stages"):
+            self.local.stages = []
+        return self.local.stages
+
+    def mark_external(self) -> None:
+        # files opened by a child process or the jvm daemon never show up as
+        # audit events, the stage's file counts would be a silent 0
+        for stage in getattr(self.local, "stages", []):
+            stage.external = True
+
+    def audit(self, event: str, event_args: tuple) -> None:
+        if not self.enabled or event not in ("open", "subprocess.Popen"):
+            return
+        stages = getattr(self.local, "stages", None)
+        if not stages:
+            return
+        if event == "subprocess.Popen":
+            self.mark_external()
+            return
+        path, mode, flags = event_args
+        if not isinstance(path, (str, bytes, os.PathLike)):
+            return
+        path = os.fsdecode(path)
+        if mode is not None:
+            writing = any(char in mode for char in "wax+")
+        else:
+            writing = bool(flags & WRITE_FLAGS)
+        for stage in stages:
+            (stage.written if writing else stage.read).add(path)
+
+    @contextmanager
+    def stage(self, name: str, category: str = "stage"):
+        if not self.enabled:
+            yield
+            return
+
+        active = ActiveStage()
+        stages = self.active_stages()
+        stages.append(active)
+        start = time.perf_counter()
+        cpu = time.process_time()
+        children = os.times()
+        rss = current_rss_kb()
+        try:
+            yield
+        finally:
+            stages.remove(active)
+            wall = time.perf_counter() - start
+            children_end = os.times()
+            rss_end = current_rss_kb()
+            bytes_written = None if active.external else 0
+            for path in active.written if not active.external else []:
+                try:
+                    bytes_written += os.path.getsize(path)
+                except OSError:
+                    pass
+            with self.lock:
+                thread = self.threads.setdefault(
+                    threading.get_ident(), len(self.threads) + 1
+                )
+                self.records.append(
+                    {
+                        "name": name,
+                        "category": category,
+                        "thread": thread,
+                        "start": start - self.origin,
+                        "wall": wall,
+                        # process wide, concurrent patches share it
+                        "cpu": time.process_time() - cpu,
+                        "children_cpu": (
+                            children_end.children_user
+                            + children_end.children_system
+                            - children.children_user
+                            - children.children_system
+                        ),
+                        "rss_delta_kb": rss_end - rss
+                        if rss is not None and rss_end is not None
+                        else None,
+                        # high-water marks since the process started, not per stage
+                        "process_peak_rss_kb": peak_rss_kb(resource.RUSAGE_SELF)
+                        if resource
+                        else None,
+                        "children_process_peak_rss_kb": peak_rss_kb(
+                            resource.RUSAGE_CHILDREN
+                        )
+                        if resource
+                        else None,
+                        "files_read": None
+                        if active.external
+                        else len(active.read - active.written),
+                        "files_written": None
+                        if active.external
+                        else len(active.written),
+                        "bytes_written": bytes_written,
+                    }
+                )
+
+    def report(self) -> dict:
+        return {
+            "wall": time.perf_counter() - self.origin,
+            "stages": sorted(self.records, key=lambda record: record["start"]),
+        }
+
+    def chrome_trace(self) -> dict:
+        return {
+            "traceEvents": [
+                {
+                    "name": record["name"],
+                    "cat": record["category"],
+                    "ph": "X",
+                    "ts": int(record["start"] * 1_000_000),
+                    "dur": int(record["wall"] * 1_000_000),
+                    "pid": os.getpid(),
+                    "tid": record["thread"],
+                    "args": {
+                        key: value
+                        for key, value in record.items()
+                        if key not in ("name", "category", "thread", "start", "wall")
+                    },
+                }
+                for record in self.records
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def write(self, report_path: str | None, trace_path: str | None) -> None:
+        self.enabled = False
+        if report_path:
+            with open(report_path, "w", encoding="utf-8") as file:
+                json.dump(self.report(), file, indent=4, ensure_ascii=False)
+        if trace_path:
+            with open(trace_path, "w", encoding="utf-8") as file:
+                json.dump(self.chrome_trace(), file)
+
+
+profiler = Profiler()
@@ -0,0 +1,66 @@
+import json
+import os
+from repo_types import PatchMetaData, RepoManifest
+
+
+class RepositoryEntry:
+    def __init__(self, stamp: tuple, manifest: RepoManifest, patch_files: list[str]):
+        self.stamp = stamp
+        self.manifest = manifest
+        self.patches: list[PatchMetaData] = sorted(
+            (p for p in manifest["patches"] if p["filename"] in patch_files),
+            key=lambda x: x["title"],
+        )
+        self.by_uuid = {p["uuid"]: p for p in self.patches}
+        self.by_title = {p["title"]: p for p in self.patches}
+        self.by_filename = {p["filename"]: p for p in self.patches}
+
+
+class RepositoryRegistry:
+    def __init__(self, root: str = "repos"):
+        self.root = root
+        self.entries: dict[str, RepositoryEntry] = {}
+
+    def repo_path(self, repo_uuid: str) -> str:
+        return os.path.join(self.root, repo_uuid.replace("-", "_"))
+
+    def get(self, repo_uuid: str) -> RepositoryEntry:
+        repo_path = self.repo_path(repo_uuid)
+        manifest_stat = os.stat(os.path.join(repo_path, "manifest.json"))
+        patches_stat = os.stat(os.path.join(repo_path, "patches"))
+        # adding or removing a patch file bumps the folder mtime
+        stamp = (
+            manifest_stat.st_mtime_ns,
+            manifest_stat.st_size,
+            patches_stat.st_mtime_ns,
+        )
+
+        entry = self.entries.get(repo_uuid)
+        if entry is not None and entry.stamp == stamp:
+            return entry
+
+        with open(os.path.join(repo_path, "manifest.json"), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        entry = RepositoryEntry(
+            stamp, manifest, os.listdir(os.path.join(repo_path, "patches"))
+        )
+        self.entries[repo_uuid] = entry
+        return entry
+
+    def manifest(self, repo_uuid: str) -> RepoManifest:
+        return self.get(repo_uuid).manifest
+
+    def patches(self, repo_uuid: str) -> list[PatchMetaData]:
+        return self.get(repo_uuid).patches
+
+    def find_by_uuid(self, repo_uuid: str, uuid: str) -> PatchMetaData | None:
+        return self.get(repo_uuid).by_uuid.get(uuid)
+
+    def find_by_title(self, repo_uuid: str, title: str) -> PatchMetaData | None:
+        return self.get(repo_uuid).by_title.get(title)
+
+    def find_by_filename(self, repo_uuid: str, filename: str) -> PatchMetaData | None:
+        return self.get(repo_uuid).by_filename.get(filename)
+
+
+registry = RepositoryRegistry()
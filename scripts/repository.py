@@ -1,6 +1,7 @@
 import os
 import requests
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from config import config, log, console, args
 from rich.progress import (
     BarColumn,
@@ -13,6 +14,13 @@ from rich.progress import (
 import json
 
 from repo_types import RepoManifest, PatchMetaData, ResourceMetaData
+from scripts.downloader import (
+    DownloadError,
+    HashCache,
+    HttpCache,
+    download_to_file,
+    get_session,
+)
 
 progress = Progress(
     TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
@@ -43,7 +51,7 @@ def add_repository(url: str):
     if not url.endswith("manifest.json"):
         url += "manifest.json"
     log.info(f"Adding repo {url}")
-    response = requests.get(url)
+    response = get_session().get(url)
     if response.status_code != 200:
         log.error(f"failed to add repo {url}, got response code {response.status_code}")
         exit(1)
@@ -67,6 +75,9 @@ def add_repository(url: str):
         encoding="utf-8",
     ) as file:
         json.dump(manifest, file, indent=4, ensure_ascii=False)
+    http_cache = get_http_cache(repo_path)
+    http_cache.update(url, response)
+    http_cache.save()
 
     with open(args.config, "w", encoding="utf-8") as file:
         config["repositories"].append(
@@ -104,34 +115,75 @@ def save_manifest(repo_path: str, manifest: RepoManifest):
         json.dump(manifest, file, indent=4, ensure_ascii=False)
 
 
-def download_file(url: str, path: str, name: str):
-    log.info(f"Requesting {url}")
-    response = requests.get(url, stream=True)
-    total = int(response.headers.get("content-length", None))
-    task_id = progress.add_task(
-        f"download-{name}", start=False, total=total, filename=name
-    )
+def get_http_cache(repo_path: str) -> HttpCache:
+    return HttpCache(os.path.join(repo_path, "http_cache.json"))
 
-    if response.status_code != 200:
+
+def get_hash_cache(repo_path: str) -> HashCache:
+    return HashCache(os.path.join(repo_path, "hashes.json"))
+
+
+def download_file(
+    url: str,
+    path: str,
+    name: str,
+    http_cache: HttpCache | None = None,
+    sha256: str | None = None,
+    hash_cache: HashCache | None = None,
+) -> bool:
+    log.info(f"Requesting {url}")
+    headers = {}
+    # with a known hash the local copy was already checked, it is missing or stale
+    if http_cache is not None and sha256 is None and os.path.exists(path):
+        headers = http_cache.headers(url)
+    try:
+        response, digest = download_to_file(
+            url, path, name, progress, headers=headers, sha256=sha256
+        )
+    except DownloadError as e:
+        log.error(f"Failed to download {name}, {e}")
+        return False
+
+    if response is not None and response.status_code == 304:
+        log.info(f"Not modified: {name}")
+        return True
+    if digest is None:
         log.error(
-            f"Failed to download {name}, got response code {response.status_code}"
+            f"Failed to download {name}, got response code "
+            f"{response.status_code if response is not None else None}"
         )
-        progress.remove_task(task_id)
-        return
+        return False
 
     type = path.split("/")[-2]
     name = path.split("/")[-1]
-    with open(path, "wb") as file:
-        progress.start_task(task_id)
-        for bytes in response.iter_content(chunk_size=32768):
-            size = file.write(bytes)
-            progress.update(task_id, advance=size)
     log.info(f"Downloaded {type}: {name}")
-    progress.remove_task(task_id)
+    if hash_cache is not None:
+        hash_cache.record(path, digest)
+    if http_cache is not None:
+        http_cache.update(url, response)
+    return True
+
+
+def needs_download(
+    path: str, entry: dict, old_entry: dict | None, hash_cache: HashCache
+) -> bool:
+    if entry.get("sha256"):
+        return hash_cache.sha256(path) != entry["sha256"].lower()
+    return (
+        not old_entry
+        or old_entry.get("sha256") != entry.get("sha256")
+        or not os.path.exists(path)
+    )
 
 
-def download_patch(url: str, repo: RepoManifest, patch: PatchMetaData):
-    download_file(
+def download_patch(
+    url: str,
+    repo: RepoManifest,
+    patch: PatchMetaData,
+    http_cache: HttpCache | None = None,
+    hash_cache: HashCache | None = None,
+) -> bool:
+    return download_file(
         url,
         os.path.join(
             "repos",
@@ -140,10 +192,19 @@ def download_patch(url: str, repo: RepoManifest, patch: PatchMetaData):
             patch["filename"],
         ),
         patch["filename"],
+        http_cache,
+        patch.get("sha256"),
+        hash_cache,
     )
 
 
-def download_resource(url: str, repo: RepoManifest, resource: ResourceMetaData):
+def download_resource(
+    url: str,
+    repo: RepoManifest,
+    resource: ResourceMetaData,
+    http_cache: HttpCache | None = None,
+    hash_cache: HashCache | None = None,
+) -> bool:
     res_dir = resource["directory"]
     if not res_dir.endswith("/"):
         res_dir += "/"
@@ -154,96 +215,173 @@ def download_resource(url: str, repo: RepoManifest, resource: ResourceMetaData):
     )
 
     os.makedirs(res_dir_path, exist_ok=True)
-    download_file(
+    return download_file(
         url,
         os.path.join(
             res_dir_path,
             resource["filename"],
         ),
         resource["filename"],
+        http_cache,
+        resource.get("sha256"),
+        hash_cache,
     )
 
 
+def fetch_manifest(repo, http_cache: HttpCache) -> tuple[RepoManifest | None, bool]:
+    log.info(f"Updating repo: `{repo['title']}`")
+    repo_path = os.path.join("repos", repo["uuid"].replace("-", "_"))
+    headers = {}
+    if os.path.exists(os.path.join(repo_path, "manifest.json")):
+        headers = http_cache.headers(repo["url"])
+    try:
+        response = get_session().get(repo["url"], headers=headers)
+        if response.status_code == 304:
+            # nothing changed upstream, only make sure every file is still on disk
+            log.info(f"repo `{repo['title']}` not modified")
+            return load_manifest(repo_path), False
+        if response.status_code != 200:
+            log.error(
+                f"failed to update repo `{repo['title']}`, got response code {response.status_code}"
+            )
+            return None, False
+    except requests.exceptions.RequestException as e:
+        log.error(f"failed to update repo `{repo['title']}`, {e}")
+        return None, False
+    http_cache.update(repo["url"], response)
+    manifest = response.json()
+    return manifest, manifest != load_manifest(repo_path)
+
+
+def submit_repository_downloads(
+    executor: ThreadPoolExecutor,
+    repo,
+    new_manifest: RepoManifest,
+    http_cache: HttpCache,
+    hash_cache: HashCache,
+) -> list[Future]:
+    repo_path = os.path.join("repos", repo["uuid"].replace("-", "_"))
+    patches_path = os.path.join(repo_path, "patches")
+    resources_path = os.path.join(repo_path, "resources")
+    old_manifest = load_manifest(repo_path)
+    repo_base_url = repo["url"].removesuffix("manifest.json").removesuffix("/")
+
+    if not os.path.exists(os.path.join(patches_path, "__init__.py")):
+        with open(os.path.join(patches_path, "__init__.py"), "w", encoding="utf-8") as file:
+            file.write("")
+
+    futures = []
+    for patch in new_manifest["patches"]:
+        existing_patch = next(
+            (p for p in old_manifest["patches"] if p.get("uuid") == patch.get("uuid")),
+            None,
+        )
+        if needs_download(
+            os.path.join(patches_path, patch["filename"]),
+            patch,
+            existing_patch,
+            hash_cache,
+        ):
+            futures.append(
+                executor.submit(
+                    download_patch,
+                    f"{repo_base_url}/patches/{patch['filename']}",
+                    new_manifest,
+                    patch,
+                    http_cache,
+                    hash_cache,
+                )
+            )
+    for resource in new_manifest["resources"]:
+        res_dir = resource["directory"]
+        if not res_dir.endswith("/"):
+            res_dir += "/"
+
+        existing_resource = next(
+            (
+                p
+                for p in old_manifest["resources"]
+                if p.get("filename") == resource.get("filename")
+            ),
+            None,
+        )
+        if needs_download(
+            f"{resources_path}{res_dir}{resource['filename']}",
+            resource,
+            existing_resource,
+            hash_cache,
+        ):
+            futures.append(
+                executor.submit(
+                    download_resource,
+                    f"{repo_base_url}/resources{res_dir}{resource['filename']}",
+                    new_manifest,
+                    resource,
+                    http_cache,
+                    hash_cache,
+                )
+            )
+    return futures
+
+
 def fetch_repositories():
     log.info("Fetching repositories")
+    http_caches = []
+    hash_caches = []
     for repo in config["repositories"]:
         repo_path = os.path.join("repos", repo["uuid"].replace("-", "_"))
-        patches_path = os.path.join(repo_path, "patches")
-        resources_path = os.path.join(repo_path, "resources")
-
-        os.makedirs(repo_path, exist_ok=True)
-        os.makedirs(patches_path, exist_ok=True)
-        os.makedirs(resources_path, exist_ok=True)
-
-        log.info(f"Updating repo: `{repo['title']}`")
-        try:
-            response = requests.get(repo["url"])
-            if response.status_code != 200:
-                log.error(
-                    f"failed to update repo `{repo['title']}`, got response code {response.status_code}"
-                )
-                continue
-        except requests.exceptions.RequestException as e:
-            log.error(f"failed to update repo `{repo['title']}`, {e}")
-            continue
-
-        old_manifest = load_manifest(repo_path)
-        new_manifest: RepoManifest = response.json()
-        repo_base_url = repo["url"].removesuffix("manifest.json").removesuffix("/")
-
-        if not os.path.exists(os.path.join(patches_path, "__init__.py")):
-            with open(
-                os.path.join(patches_path, "__init__.py"), "w", encoding="utf-8"
-            ) as file:
-                file.write("")
+        os.makedirs(os.path.join(repo_path, "patches"), exist_ok=True)
+        os.makedirs(os.path.join(repo_path, "resources"), exist_ok=True)
+        http_caches.append(get_http_cache(repo_path))
+        hash_caches.append(get_hash_cache(repo_path))
+
+    with ThreadPoolExecutor(max_workers=config["download_workers"]) as executor:
+        fetched = list(
+            executor.map(fetch_manifest, config["repositories"], http_caches)
+        )
+        manifests = [manifest for manifest, _ in fetched]
+        modified = [changed for _, changed in fetched]
 
         with progress:
             progress.start()
-            for patch in new_manifest["patches"]:
-                existing_patch = next(
-                    (
-                        p
-                        for p in old_manifest["patches"]
-                        if p.get("uuid") == patch.get("uuid")
+            downloads = [
+                (
+                    repo,
+                    manifest,
+                    changed,
+                    http_cache,
+                    hash_cache,
+                    submit_repository_downloads(
+                        executor, repo, manifest, http_cache, hash_cache
                     ),
-                    None,
                 )
-                if (
-                    not existing_patch
-                    or existing_patch.get("sha256") != patch.get("sha256")
-                    or not os.path.exists(os.path.join(patches_path, patch["filename"]))
-                ):
-                    download_patch(
-                        f"{repo_base_url}/patches/{patch['filename']}",
-                        new_manifest,
-                        patch,
-                    )
-            for resource in new_manifest["resources"]:
-                res_dir = resource["directory"]
-                if not res_dir.endswith("/"):
-                    res_dir += "/"
-
-                existing_resource = next(
-                    (
-                        p
-                        for p in old_manifest["resources"]
-                        if p.get("filename") == resource.get("filename")
-                    ),
-                    None,
+                for repo, manifest, changed, http_cache, hash_cache in zip(
+                    config["repositories"], manifests, modified, http_caches, hash_caches
                 )
-                if (
-                    not existing_resource
-                    or existing_resource.get("sha256") != resource.get("sha256")
-                    or not os.path.exists(
-                        f"{resources_path}{res_dir}{resource['filename']}"
+                if manifest is not None
+            ]
+            for repo, manifest, changed, http_cache, hash_cache, futures in downloads:
+                wait(futures)
+                failed = 0
+                for future in futures:
+                    if future.exception() is not None:
+                        log.error(
+                            f"error while updating repo `{repo['title']}`: {future.exception()}"
+                        )
+                    if future.exception() is not None or not future.result():
+                        failed += 1
+                # rewriting an unchanged manifest would bump its mtime, the
+                # registry and service workers would reload the repo for nothing
+                if changed:
+                    save_manifest(
+                        os.path.join("repos", repo["uuid"].replace("-", "_")), manifest
                     )
-                ):
-                    download_resource(
-                        f"{repo_base_url}/resources{res_dir}{resource['filename']}",
-                        new_manifest,
-                        resource,
+                http_cache.save()
+                hash_cache.save()
+                if failed:
+                    log.warning(
+                        f"Updated repo: {repo['title']}, {failed} files failed to download"
                     )
+                else:
+                    log.info(f"Updated repo: {repo['title']}")
             progress.stop()
-
-        save_manifest(repo_path, new_manifest)
-        log.info(f"Updated repo: {repo['title']}")
@@ -0,0 +1,133 @@
+import os
+from typing import TypedDict
+from lxml import etree
+from config import config, log
+from scripts.utils import XmlEditSession
+
+ARRAY_TAGS = ("string-array", "integer-array")
+SKIPPED_TAGS = ("declare-styleable", "eat-comment", "public")
+
+
+class ResourceEntry(TypedDict):
+    type: str
+    name: str
+    qualifier: str
+    file: str
+    element: etree._Element
+
+
+def resource_type(element: etree._Element) -> str:
+    if element.tag == "item":
+        return element.get("type", "item")
+    if element.tag in ARRAY_TAGS:
+        return "array"
+    return element.tag
+
+
+class ResourceTable:
+    def __init__(self, res_root: str | None = None, session: XmlEditSession | None = None):
+        self.res_root = res_root or os.path.join(config["folders"]["decompiled"], "res")
+        self.session = session or XmlEditSession()
+        self.entries: dict[tuple[str, str, str], ResourceEntry] = {}
+        self.qualifiers_by_name: dict[tuple[str, str], list[str]] = {}
+        self._build()
+
+    def __enter__(self) -> "ResourceTable":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def _build(self) -> None:
+        for folder in sorted(os.listdir(self.res_root)):
+            if folder != "values" and not folder.startswith("values-"):
+                continue
+            qualifier = folder.removeprefix("values").removeprefix("-")
+            folder_path = os.path.join(self.res_root, folder)
+            for file in sorted(os.listdir(folder_path)):
+                if not file.endswith(".xml"):
+                    continue
+                file_path = os.path.join(folder_path, file)
+                for element in self.session.root(file_path):
+                    if not isinstance(element.tag, str) or element.tag in SKIPPED_TAGS:
+                        continue
+                    name = element.get("name")
+                    if name is None:
+                        continue
+                    type = resource_type(element)
+                    self.entries[(type, name, qualifier)] = {
+                        "type": type,
+                        "name": name,
+                        "qualifier": qualifier,
+                        "file": file_path,
+                        "element": element,
+                    }
+                    self.qualifiers_by_name.setdefault((type, name), []).append(qualifier)
+
+    def get(self, type: str, name: str, qualifier: str = "") -> ResourceEntry | None:
+        return self.entries.get((type, name, qualifier))
+
+    def qualifiers(self, type: str, name: str) -> list[str]:
+        return self.qualifiers_by_name.get((type, name), [])
+
+    def value(self, type: str, name: str, qualifier: str = "") -> str | None:
+        entry = self.get(type, name, qualifier)
+        return None if entry is None else entry["element"].text
+
+    def _targets(
+        self, type: str, name: str, qualifiers: list[str] | None
+    ) -> list[ResourceEntry]:
+        return [
+            self.entries[(type, name, qualifier)]
+            for qualifier in self.qualifiers(type, name)
+            if qualifiers is None or qualifier in qualifiers
+        ]
+
+    def update(
+        self, type: str, values: dict[str, str], qualifiers: list[str] | None = None
+    ) -> int:
+        changed = 0
+        for name, value in values.items():
+            targets = self._targets(type, name, qualifiers)
+            if not targets:
+                log.warning(f"resource {type}/{name} not found")
+            for entry in targets:
+                # strings may carry markup, the new value replaces all of it
+                for child in list(entry["element"]):
+                    entry["element"].remove(child)
+                entry["element"].text = value
+                self.session.mark_dirty(entry["file"])
+                changed += 1
+        return changed
+
+    def update_colors(self, values: dict[str, str], qualifiers: list[str] | None = None) -> int:
+        return self.update("color", values, qualifiers)
+
+    def update_dimens(self, values: dict[str, str], qualifiers: list[str] | None = None) -> int:
+        return self.update("dimen", values, qualifiers)
+
+    def update_strings(self, values: dict[str, str], qualifiers: list[str] | None = None) -> int:
+        return self.update("string", values, qualifiers)
+
+    def update_styles(
+        self, values: dict[str, dict[str, str]], qualifiers: list[str] | None = None
+    ) -> int:
+        changed = 0
+        for name, items in values.items():
+            targets = self._targets("style", name, qualifiers)
+            if not targets:
+                log.warning(f"resource style/{name} not found")
+            for entry in targets:
+                style = entry["element"]
+                for item_name, value in items.items():
+                    item = style.find(f"item[@name='{item_name}']")
+                    if item is None:
+                        item = etree.SubElement(style, "item", name=item_name)
+                    item.text = value
+                    changed += 1
+                self.session.mark_dirty(entry["file"])
+        return changed
+
+    def flush(self) -> None:
+        self.session.flush()
@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TypedDict
+import requests
+from config import config, log
+from scripts.headless import (
+    EXIT_INVALID_PROFILE,
+    EXIT_SERVICE_UNAVAILABLE,
+    load_profile,
+    profile_error,
+    results_exit_code,
+    split_profile,
+)
+from scripts.pipeline import BatchResult, run_batch_job
+
+FINISHED_STATUSES = ["ok", "partial", "patch failed", "failed", "cancelled"]
+
+
+class Job(TypedDict):
+    id: str
+    apk: str
+    status: str
+    submitted: float
+    finished: float | None
+    result: BatchResult | None
+
+
+class JobQueue:
+    def __init__(self, workers: int):
+        # long-lived workers keep patch modules and the registry warm between jobs
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.jobs: dict[str, Job] = {}
+        self.futures: dict[str, Future] = {}
+        self.next_id = 1
+
+    def job_folders(self, job_id: str) -> tuple[str, str]:
+        return (
+            f"{config['folders']['decompiled']}-job{job_id}",
+            os.path.join(config["folders"]["out"], "jobs", job_id),
+        )
+
+    def prune(self) -> None:
+        # finished jobs and their artifacts go after the retention time, and the
+        # oldest ones beyond the count limit
+        deadline = time.time() - config["service_job_retention_hours"] * 3600
+        with self.lock:
+            finished = sorted(
+                (job for job in self.jobs.values() if job["finished"] is not None),
+                key=lambda job: job["finished"],
+            )
+            excess = len(finished) - config["service_max_finished_jobs"]
+            pruned = [
+                job["id"]
+                for index, job in enumerate(finished)
+                if index < excess or job["finished"] < deadline
+            ]
+            for job_id in pruned:
+                del self.jobs[job_id]
+                del self.futures[job_id]
+        for job_id in pruned:
+            shutil.rmtree(self.job_folders(job_id)[1], ignore_errors=True)
+        if pruned:
+            log.info(f"pruned {len(pruned)} finished jobs")
+
+    def submit(self, apk: str, profile: dict) -> Job:
+        self.prune()
+        run, settings = split_profile(profile)
+        with self.lock:
+            job_id = str(self.next_id)
+            self.next_id += 1
+            job: Job = {
+                "id": job_id,
+                "apk": apk,
+                "status": "queued",
+                "submitted": time.time(),
+                "finished": None,
+                "result": None,
+            }
+            self.jobs[job_id] = job
+            decompiled, out = self.job_folders(job_id)
+            future = self.executor.submit(
+                run_batch_job,
+                apk,
+                settings,
+                decompiled,
+                out,
+                run.get("on_failure", "skip") == "build",
+            )
+            self.futures[job_id] = future
+        future.add_done_callback(lambda future: self.finish(job_id, future))
+        log.info(f"job {job_id}: `{apk}` queued")
+        return job
+
+    def finish(self, job_id: str, future: Future) -> None:
+        try:
+            result = future.result()
+            status = result["status"]
+        except CancelledError:
+            result, status = None, "cancelled"
+        except BaseException as e:
+            # run_cmd exits on a failed tool, that surfaces here as SystemExit
+            log.error(f"job {job_id} failed: {e!r}")
+            result, status = None, "failed"
+        with self.lock:
+            job = self.jobs[job_id]
+            job["status"], job["result"], job["finished"] = status, result, time.time()
+        # the output folder stays for the artifact, the working tree is not needed
+        shutil.rmtree(self.job_folders(job_id)[0], ignore_errors=True)
+        log.info(f"job {job_id}: `{job['apk']}` finished: {status}")
+        self.prune()
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        if job["status"] == "queued" and self.futures[job_id].running():
+            job["status"] = "running"
+        return job
+
+    def list(self) -> list[Job]:
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.get(job_id) for job_id in job_ids]
+
+    def cancel(self, job_id: str) -> bool:
+        future = self.futures.get(job_id)
+        return future is not None and future.cancel()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    queue: JobQueue
+
+    def log_message(self, format: str, *args) -> None:
+        log.debug(f"{self.address_string()} {format % args}")
+
+    def send_json(self, status: int, data) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def host_allowed(self) -> bool:
+        # a web page can reach 127.0.0.1 too, by a rebound dns name it can
+        # even read the answers, those requests carry the page's host name
+        port = self.server.server_address[1]
+        if self.headers.get("Host") in (f"127.0.0.1:{port}", f"localhost:{port}"):
+            return True
+        self.send_json(403, {"error": "unexpected host"})
+        return False
+
+    def send_artifact(self, job: Job) -> None:
+        output = job["result"]["output"] if job["result"] else None
+        if output is None or not os.path.isfile(output):
+            self.send_json(404, {"error": "job has no artifact"})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.android.package-archive")
+        self.send_header("Content-Length", str(os.path.getsize(output)))
+        self.send_header(
+            "Content-Disposition", f'attachment; filename="{os.path.basename(output)}"'
+        )
+        self.end_headers()
+        with open(output, "rb") as file:
+            shutil.copyfileobj(file, self.wfile)
+
+    def do_GET(self) -> None:
+        if not self.host_allowed():
+            return
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self.send_json(200, self.queue.list())
+            return
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.queue.get(parts[1])
+            if job is None:
+                self.send_json(404, {"error": "unknown job"})
+            elif len(parts) == 2:
+                self.send_json(200, job)
+            elif parts[2] == "artifact":
+                self.send_artifact(job)
+            else:
+                self.send_json(404, {"error": "not found"})
+            return
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if not self.host_allowed():
+            return
+        # browsers send a cross-site form or text/plain post without asking,
+        # application/json needs a preflight the service never answers
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type.lower() != "application/json":
+            self.send_json(415, {"error": "content type must be application/json"})
+            return
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            if self.queue.cancel(parts[1]):
+                self.send_json(200, {"id": parts[1], "status": "cancelled"})
+            else:
+                self.send_json(409, {"error": "job can't be cancelled"})
+            return
+        if parts != ["jobs"]:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            apk, profile = request["apk"], request.get("profile", {})
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"bad request: {e!r}"})
+            return
+        # only apks from the apks folder, the name must not walk out of it
+        if os.path.basename(apk) != apk or not os.path.isfile(
+            f"{config['folders']['apks']}/{apk}"
+        ):
+            self.send_json(400, {"error": f"apk `{apk}` not found"})
+            return
+        error = profile_error(split_profile(profile)[0])
+        if error:
+            self.send_json(400, {"error": error})
+            return
+        self.send_json(202, self.queue.submit(apk, profile))
+
+
+def serve(port: int, workers: int) -> None:
+    queue = JobQueue(workers)
+    ServiceHandler.queue = queue
+    server = ThreadingHTTPServer(("127.0.0.1", port), ServiceHandler)
+    log.info(f"build service listening on http://127.0.0.1:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info("stopping build service")
+    finally:
+        server.server_close()
+        queue.shutdown()
+
+
+def submit_jobs(port: int, profile_path: str, apk: str | None) -> int:
+    url = f"http://127.0.0.1:{port}"
+    run, settings = load_profile(profile_path)
+    apks = [apk] if apk else run.get("apks", [])
+    if not apks:
+        log.error("no apks to submit, pass `--apk` or list them in the profile")
+        return EXIT_INVALID_PROFILE
+
+    profile = {"run": run, **settings}
+    try:
+        job_ids = []
+        for apk in apks:
+            response = requests.post(f"{url}/jobs", json={"apk": apk, "profile": profile})
+            if response.status_code != 202:
+                log.error(f"`{apk}` rejected: {response.json()['error']}")
+                return EXIT_INVALID_PROFILE
+            job_ids.append(response.json()["id"])
+            log.info(f"`{apk}` submitted as job {job_ids[-1]}")
+
+        results: list[BatchResult] = []
+        for job_id in job_ids:
+            while True:
+                response = requests.get(f"{url}/jobs/{job_id}")
+                if response.status_code != 200:
+                    log.error(f"job {job_id}: {response.json()['error']}")
+                    return EXIT_SERVICE_UNAVAILABLE
+                job = response.json()
+                if job["status"] in FINISHED_STATUSES:
+                    break
+                time.sleep(1)
+            log.info(f"job {job_id}: `{job['apk']}` finished: {job['status']}")
+            results.append(job["result"] or {"apk": job["apk"], "status": job["status"]})
+    except (requests.RequestException, ValueError, KeyError) as e:
+        log.error(f"build service at {url} is not reachable or answered garbage: {e}")
+        return EXIT_SERVICE_UNAVAILABLE
+    print(json.dumps(results, indent=4, ensure_ascii=False))
+    return results_exit_code(results)
@@ -0,0 +1,137 @@
+import json
+import os
+import re
+import threading
+from config import config, log
+from scripts.decompile_cache import (
+    cache_lock,
+    decompile_cache_key,
+    decompile_cache_root,
+    load_cache_meta,
+)
+from scripts.profiler import profiler
+from scripts.smali_parser import SmaliDocument, get_smali_lines, list_smali_files
+
+INDEX_VERSION = 3
+
+CONST_STRING = re.compile(r'^\s*const-string(?:/jumbo)?\s+[vp]\d+,\s*"(.*)"\s*$')
+
+
+class SmaliIndex:
+    # the index only says which file holds what, it is built from the pristine
+    # tree while patches edit the working one, so lines are looked up in the
+    # file as it is at the time of the query
+    def __init__(self, root: str, apk_path: str):
+        self.root = root
+        self.apk_path = apk_path
+        self.lock = threading.Lock()
+        self.data: dict | None = None
+
+    def load(self) -> dict:
+        with self.lock:
+            if self.data is None:
+                with profiler.stage("smali index"):
+                    self.data = load_smali_index(self.apk_path)
+            return self.data
+
+    def file(self, path: str) -> str | None:
+        file = os.path.join(self.root, path)
+        return file if os.path.isfile(file) else None
+
+    def find_class(self, descriptor: str) -> str | None:
+        path = self.load()["classes"].get(descriptor)
+        return self.file(path) if path else None
+
+    def find_method(
+        self, descriptor: str, signature: str
+    ) -> tuple[str, int, int] | None:
+        path = self.load()["methods"].get(f"{descriptor}->{signature}")
+        file = self.file(path) if path else None
+        if file is None:
+            return None
+        span = SmaliDocument.load(file).method(signature)
+        return (file, *span) if span else None
+
+    def find_string(self, value: str) -> list[tuple[str, int]]:
+        locations = []
+        for path in self.load()["strings"].get(value, []):
+            file = self.file(path)
+            if file is None:
+                continue
+            for index, line in enumerate(get_smali_lines(file)):
+                if "const-string" not in line:
+                    continue
+                match = CONST_STRING.match(line)
+                if match and match.group(1) == value:
+                    locations.append((file, index))
+        return locations
+
+
+def index_smali_file(root: str, file: str) -> dict:
+    document = SmaliDocument.load(file)
+    strings = set()
+    for line in document.lines:
+        if "const-string" not in line:
+            continue
+        match = CONST_STRING.match(line)
+        if match:
+            strings.add(match.group(1))
+    return {
+        "path": os.path.relpath(file, root),
+        "class": document.class_name,
+        "methods": list(document.methods),
+        "strings": strings,
+    }
+
+
+def build_smali_index(root: str) -> dict:
+    data = {"version": INDEX_VERSION, "classes": {}, "methods": {}, "strings": {}}
+    for file in list_smali_files(root):
+        entry = index_smali_file(root, file)
+        if entry["class"] is None:
+            continue
+        data["classes"][entry["class"]] = entry["path"]
+        for signature in entry["methods"]:
+            data["methods"][f"{entry['class']}->{signature}"] = entry["path"]
+        for value in entry["strings"]:
+            data["strings"].setdefault(value, []).append(entry["path"])
+    return data
+
+
+def smali_index_path(key: str) -> str:
+    return os.path.join(config["folders"]["cache"], "index", f"{key}.json")
+
+
+def save_smali_index(key: str, data: dict) -> None:
+    path = smali_index_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # per-process temp file, batch workers may index the same apk at once
+    with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def load_smali_index(apk_path: str, rebuild: bool = False) -> dict:
+    key = decompile_cache_key(apk_path)
+    path = smali_index_path(key)
+    if not rebuild and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("version") == INDEX_VERSION:
+            log.info(f"loaded smali index: {path}")
+            return data
+
+    # only the pristine tree from the decompile cache is stored, the working
+    # tree may already carry patches
+    pristine = os.path.join(decompile_cache_root(), key)
+    with cache_lock(key):
+        if load_cache_meta(key) is None or not os.path.isdir(pristine):
+            log.info("Building smali index from the working tree, not caching it")
+            return build_smali_index(config["folders"]["decompiled"])
+        log.info("Building smali index")
+        data = build_smali_index(pristine)
+    save_smali_index(key, data)
+    log.info(
+        f"smali index built: {len(data['classes'])} classes, {len(data['methods'])} methods"
+    )
+    return data
@@ -1,3 +1,12 @@
+import bisect
+import functools
+import mmap
+import os
+import re
+from typing import TypedDict
+from scripts.worktree import detach_file
+
+
 def get_smali_lines(file: str) -> list[str]:
     lines = []
     with open(file, "r", encoding="utf-8") as smali:
@@ -6,10 +15,13 @@ def get_smali_lines(file: str) -> list[str]:
 
 
 def save_smali_lines(file: str, lines: list[str]) -> None:
+    detach_file(file)
     with open(file, "w", encoding="utf-8") as f:
         f.writelines(lines)
 
 
+# these scan only the method around index, for many lookups in one file
+# SmaliDocument keeps an index of every method
 def find_smali_method_start(lines: list[str], index: int) -> int:
     while True:
         index -= 1
@@ -52,7 +64,328 @@ def replace_smali_method_body(
 def find_and_replace_smali_line(
     lines: list[str], search: str, replace: str
 ) -> list[str]:
-    for index, line in enumerate(lines):
-        if line.find(search) >= 0:
-            lines[index] = lines[index].replace(search, replace)
+    _replace_in_lines(lines, {search: replace})
     return lines
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_replacements(searches: tuple[str, ...]) -> re.Pattern:
+    # longest first, so `La/b;` never shadows `La/b;->c`
+    ordered = sorted(searches, key=len, reverse=True)
+    return re.compile("|".join(re.escape(search) for search in ordered))
+
+
+def _replace_in_lines(
+    lines: list[str], replacements: dict[str, str]
+) -> tuple[dict[str, int], list[int]]:
+    hits = dict.fromkeys(replacements, 0)
+    changed = []
+    if not replacements:
+        return hits, changed
+    pattern = _compile_replacements(tuple(replacements))
+
+    def replace(match: re.Match) -> str:
+        hits[match.group(0)] += 1
+        return replacements[match.group(0)]
+
+    for index, line in enumerate(lines):
+        if pattern.search(line):
+            lines[index] = pattern.sub(replace, line)
+            changed.append(index)
+    return hits, changed
+
+
+def find_and_replace_smali_lines(
+    lines: list[str], replacements: dict[str, str]
+) -> tuple[list[str], dict[str, int]]:
+    hits, _ = _replace_in_lines(lines, replacements)
+    return lines, hits
+
+
+def _smali_directive(line: str) -> str | None:
+    stripped = line.lstrip()
+    if stripped.startswith(".method ") or stripped.startswith(".method\t"):
+        return "method"
+    if stripped.startswith(".end method"):
+        return "end method"
+    if stripped.startswith(".field "):
+        return "field"
+    if stripped.startswith(".class ") or stripped.startswith(".super "):
+        return "class"
+    if stripped.startswith(":"):
+        return "label"
+    return None
+
+
+def _smali_signature(line: str) -> str:
+    # `.method public static a(I)V` -> `a(I)V`
+    # `.field private b:I = 0x1` -> `b:I`
+    return line.split(" = ", 1)[0].split()[-1]
+
+
+class SmaliDocument:
+    def __init__(self, lines: list[str], path: str | None = None):
+        self.path = path
+        self.lines = lines
+        self.class_name: str | None = None
+        self.super_name: str | None = None
+        self.methods: dict[str, list[int]] = {}
+        self.fields: dict[str, int] = {}
+        self.labels: dict[str, dict[str, int]] = {}
+        self._method_names: dict[str, list[str]] = {}
+        self._method_starts: list[int] = []
+        self._method_order: list[str] = []
+        self._reindex()
+
+    @classmethod
+    def load(cls, file: str) -> "SmaliDocument":
+        return cls(get_smali_lines(file), file)
+
+    def save(self, file: str | None = None) -> None:
+        save_smali_lines(file or self.path, self.lines)
+
+    def _reindex(self) -> None:
+        self.methods.clear()
+        self.fields.clear()
+        self.labels.clear()
+        self._method_names.clear()
+        current = None
+        for index, line in enumerate(self.lines):
+            directive = _smali_directive(line)
+            if directive is None:
+                continue
+            if directive == "method":
+                current = _smali_signature(line)
+                self.methods[current] = [index, index]
+                self.labels[current] = {}
+            elif directive == "end method":
+                if current is not None:
+                    self.methods[current][1] = index
+                current = None
+            elif directive == "label":
+                if current is not None:
+                    self.labels[current][line.strip()] = index
+            elif directive == "field":
+                self.fields[_smali_signature(line)] = index
+            elif line.lstrip().startswith(".class"):
+                self.class_name = _smali_signature(line)
+            else:
+                self.super_name = _smali_signature(line)
+        self._reindex_order()
+
+    def _reindex_order(self) -> None:
+        self._method_names.clear()
+        self._method_order = sorted(self.methods, key=lambda s: self.methods[s][0])
+        self._method_starts = [self.methods[s][0] for s in self._method_order]
+        for signature in self._method_order:
+            self._method_names.setdefault(signature.split("(", 1)[0], []).append(
+                signature
+            )
+
+    def _reindex_labels(self, signature: str) -> None:
+        start, end = self.methods[signature]
+        self.labels[signature] = {
+            self.lines[index].strip(): index
+            for index in range(start + 1, end)
+            if _smali_directive(self.lines[index]) == "label"
+        }
+
+    def _shift(self, after: int, delta: int) -> None:
+        for span in self.methods.values():
+            if span[0] >= after:
+                span[0] += delta
+            if span[1] >= after:
+                span[1] += delta
+        for name, index in self.fields.items():
+            if index >= after:
+                self.fields[name] = index + delta
+        for labels in self.labels.values():
+            for name, index in labels.items():
+                if index >= after:
+                    labels[name] = index + delta
+        self._method_starts = [self.methods[s][0] for s in self._method_order]
+
+    def method(self, signature: str) -> tuple[int, int] | None:
+        span = self.methods.get(signature)
+        return (span[0], span[1]) if span else None
+
+    def find_methods(self, name: str) -> list[str]:
+        return list(self._method_names.get(name, []))
+
+    def method_at(self, index: int) -> str | None:
+        position = bisect.bisect_right(self._method_starts, index) - 1
+        if position < 0:
+            return None
+        signature = self._method_order[position]
+        if index > self.methods[signature][1]:
+            return None
+        return signature
+
+    def method_lines(self, signature: str) -> list[str]:
+        start, end = self.methods[signature]
+        return self.lines[start : end + 1]
+
+    def field(self, signature: str) -> int | None:
+        return self.fields.get(signature)
+
+    def label(self, signature: str, label: str) -> int | None:
+        if not label.startswith(":"):
+            label = f":{label}"
+        return self.labels.get(signature, {}).get(label)
+
+    def find(self, search: str, start: int = 0, end: int | None = None) -> int:
+        end = len(self.lines) if end is None else end
+        for index in range(start, end):
+            if self.lines[index].find(search) >= 0:
+                return index
+        return -1
+
+    def find_in_method(self, signature: str, search: str) -> int:
+        start, end = self.methods[signature]
+        return self.find(search, start, end + 1)
+
+    def replace_lines(self, start: int, end: int, new_lines: list[str]) -> None:
+        old_lines = self.lines[start:end]
+        self.lines[start:end] = new_lines
+        structural = any(
+            _smali_directive(line) not in (None, "label")
+            for line in (*old_lines, *new_lines)
+        )
+        if structural:
+            self._reindex()
+            return
+
+        delta = len(new_lines) - len(old_lines)
+        if delta:
+            self._shift(end, delta)
+        signature = self.method_at(start)
+        if signature is not None:
+            self._reindex_labels(signature)
+
+    def insert_lines(self, index: int, new_lines: list[str]) -> None:
+        self.replace_lines(index, index, new_lines)
+
+    def replace_line(self, index: int, line: str) -> None:
+        self.replace_lines(index, index + 1, [line])
+
+    def replace_method_body(self, signature: str, new_lines: list[str]) -> None:
+        start, end = self.methods[signature]
+        self.replace_lines(start + 1, end, new_lines)
+
+    def replace_all(self, replacements: dict[str, str]) -> dict[str, int]:
+        hits, changed = _replace_in_lines(self.lines, replacements)
+        if any(_smali_directive(self.lines[index]) is not None for index in changed):
+            self._reindex()
+        return hits
+
+
+class SmaliMatch(TypedDict):
+    file: str
+    line: int
+    text: str
+    method: str | None
+    method_span: tuple[int, int] | None
+
+
+def list_smali_files(root: str) -> list[str]:
+    files = []
+    for folder in sorted(os.listdir(root)):
+        if not folder.startswith("smali") or not os.path.isdir(
+            os.path.join(root, folder)
+        ):
+            continue
+        for dirpath, _, filenames in os.walk(os.path.join(root, folder)):
+            files.extend(
+                os.path.join(dirpath, name)
+                for name in filenames
+                if name.endswith(".smali")
+            )
+    return files
+
+
+def _smali_file_contains(file: str, needle: bytes, use_mmap: bool) -> bool:
+    with open(file, "rb") as f:
+        if use_mmap:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data.find(needle) >= 0
+        data = f.read()
+    return needle in data
+
+
+def _search_smali_shard(
+    files: list[str], pattern: str, regex: bool, use_mmap: bool
+) -> list[SmaliMatch]:
+    # a regex runs on each str line, a whole file bytes pre-filter would see
+    # `^` and `$` only at the file edges and match `\w` as ascii
+    line_pattern = re.compile(pattern) if regex else None
+    needle = pattern.encode("utf-8")
+
+    matches: list[SmaliMatch] = []
+    for file in files:
+        if line_pattern is not None:
+            lines = get_smali_lines(file)
+            hits = [
+                index
+                for index, line in enumerate(lines)
+                if line_pattern.search(line) is not None
+            ]
+        elif _smali_file_contains(file, needle, use_mmap):
+            lines = get_smali_lines(file)
+            hits = [index for index, line in enumerate(lines) if line.find(pattern) >= 0]
+        else:
+            continue
+        if not hits:
+            continue
+        document = SmaliDocument(lines, file)
+        for index in hits:
+            method = document.method_at(index)
+            matches.append(
+                {
+                    "file": file,
+                    "line": index,
+                    "text": lines[index].rstrip("\n"),
+                    "method": method,
+                    "method_span": document.method(method) if method else None,
+                }
+            )
+    return matches
+
+
+def search_smali(
+    pattern: str,
+    root: str | None = None,
+    regex: bool = False,
+    workers: int | None = None,
+    use_mmap: bool = False,
+) -> list[SmaliMatch]:
+    if root is None:
+        from config import config
+
+        root = config["folders"]["decompiled"]
+
+    files = list_smali_files(root)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(files) < 256:
+        matches = _search_smali_shard(files, pattern, regex, use_mmap)
+        matches.sort(key=lambda match: (match["file"], match["line"]))
+        return matches
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # several shards per worker so one slow shard doesn't hold up the pool
+    shard_count = workers * 4
+    shards = [files[i::shard_count] for i in range(shard_count)]
+    matches: list[SmaliMatch] = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard in executor.map(
+            _search_smali_shard,
+            shards,
+            [pattern] * shard_count,
+            [regex] * shard_count,
+            [use_mmap] * shard_count,
+        ):
+            matches.extend(shard)
+    matches.sort(key=lambda match: (match["file"], match["line"]))
+    return matches
@@ -1,9 +1,14 @@
+import hashlib
 import subprocess
-from config import log, config, console
-from beaupy import select
+from typing import TYPE_CHECKING
+from config import log, config, args
 import os
-import yaml
-from lxml import etree
+from scripts.jvm_daemon import jvm_daemon
+from scripts.profiler import profiler
+from scripts.worktree import detach_file
+
+if TYPE_CHECKING:
+    from lxml import etree
 
 
 def check_java_version() -> None:
@@ -20,6 +25,11 @@ def check_java_version() -> None:
     log.info(f"found java: {version_line}")
 
 
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
 def run_cmd(cmd: list[str], ignore_error: bool = False) -> bool | None:
     try:
         subprocess.run(cmd, shell=True, check=True, text=True, stderr=subprocess.PIPE)
@@ -43,44 +53,87 @@ def run_cmd(cmd: list[str], ignore_error: bool = False) -> bool | None:
             return False
 
 
-def decompile_apk(apk_path: str) -> None:
-    run_cmd(
-        f"java -jar {config['folders']['tools']}/apktool.jar d -f -o {config['folders']['decompiled']} {apk_path}"
+def run_jar(jar: str, jar_args: list[str], ignore_error: bool = False) -> bool | None:
+    if args.jvm_daemon:
+        status = jvm_daemon.run(jar, jar_args)
+        if status == 0:
+            return True
+        if status is not None:
+            if not ignore_error:
+                log.fatal(
+                    "error of running a jar: %s %s :: exit status %s",
+                    jar,
+                    " ".join(jar_args),
+                    status,
+                )
+                exit(1)
+            log.error(
+                "error of running a jar: %s %s :: exit status %s",
+                jar,
+                " ".join(jar_args),
+                status,
+            )
+            return False
+    return run_cmd(f"java -jar {jar} {' '.join(jar_args)}", ignore_error)
+
+
+def decompile_apk(apk_path: str, out_path: str | None = None) -> None:
+    out_path = out_path or config["folders"]["decompiled"]
+    run_jar(
+        f"{config['folders']['tools']}/apktool.jar",
+        ["d", "-f", "-o", out_path, apk_path],
     )
 
 
-def compile_apk(apk_path: str) -> None:
-    run_cmd(
-        f"java -jar {config['folders']['tools']}/apktool.jar b -f -o {apk_path} {config['folders']['decompiled']}"
+def compile_apk(apk_path: str, force: bool = True) -> None:
+    run_jar(
+        f"{config['folders']['tools']}/apktool.jar",
+        [
+            "b",
+            *(["-f"] if force else []),
+            "-o",
+            apk_path,
+            config["folders"]["decompiled"],
+        ],
     )
 
 
 def sign_apk(apk_path: str) -> None:
     apk_aligned_path = apk_path.replace(".apk", "-aligned.apk")
     apk_signed_path = apk_path.replace(".apk", "-aligned-signed.apk")
-    if os.name == "nt":
-        run_cmd(
-            f"{config['folders']['tools']}/zipalign.exe -v 4 {apk_path} {apk_aligned_path}"
-        )
-    elif os.name == "posix":
-        run_cmd(
-            f"{config['folders']['tools']}/zipalign -p 4 {apk_path} {apk_aligned_path}"
-        )
-    else:
+    if os.name not in ("nt", "posix"):
         log.fatal("os not supported: %s", os.name)
         exit(1)
+    with profiler.stage("zipalign"):
+        if os.name == "nt":
+            run_cmd(
+                f"{config['folders']['tools']}/zipalign.exe -v 4 {apk_path} {apk_aligned_path}"
+            )
+        else:
+            run_cmd(
+                f"{config['folders']['tools']}/zipalign -p 4 {apk_path} {apk_aligned_path}"
+            )
 
-    cmd = f"java -jar {config['folders']['tools']}/apksigner.jar \
-        sign --v1-signing-enabled false --v2-signing-enabled true --v3-signing-enabled true"
-    cmd += f" --ks {os.getenv("KEYSTORE_PATH", "keystore.jks")}"
+    sign_args = [
+        "sign",
+        "--v1-signing-enabled",
+        "false",
+        "--v2-signing-enabled",
+        "true",
+        "--v3-signing-enabled",
+        "true",
+        "--ks",
+        os.getenv("KEYSTORE_PATH", "keystore.jks"),
+    ]
     if os.getenv("KEYSTORE_PASS"):
-        cmd += f" --ks-pass env:KEYSTORE_PASS"
+        sign_args += ["--ks-pass", "env:KEYSTORE_PASS"]
     if os.getenv("KEYSTORE_KEY_ALIAS"):
-        cmd += f" --ks-key-alias {os.getenv('KEYSTORE_KEY_ALIAS')}"
+        sign_args += ["--ks-key-alias", os.getenv("KEYSTORE_KEY_ALIAS")]
     if os.getenv("KEYSTORE_KEY_PASSWORD"):
-        cmd += f" --key-pass pass:{os.getenv('KEYSTORE_KEY_PASSWORD')}"
-    cmd += f" --out {apk_signed_path} {apk_aligned_path}"
-    run_cmd(cmd)
+        sign_args += ["--key-pass", f"pass:{os.getenv('KEYSTORE_KEY_PASSWORD')}"]
+    sign_args += ["--out", apk_signed_path, apk_aligned_path]
+    with profiler.stage("apksigner"):
+        run_jar(f"{config['folders']['tools']}/apksigner.jar", sign_args)
 
 
 def list_apks() -> list[str]:
@@ -104,6 +157,9 @@ def select_apk(apks: list[str]) -> str:
         log.info("no apks found")
         exit(0)
 
+    from beaupy import select
+    from config import console
+
     console.print("select apk file to patch")
     apks.append("cancel")
     apk = select(apks, cursor="->", cursor_style="cyan")
@@ -114,6 +170,8 @@ def select_apk(apks: list[str]) -> str:
 
 
 def read_apktool_yml() -> tuple[str, int, int, int]:
+    import yaml
+
     with open(
         f"{config['folders']['decompiled']}/apktool.yml", "r", encoding="utf-8"
     ) as f:
@@ -129,6 +187,8 @@ def read_apktool_yml() -> tuple[str, int, int, int]:
 def save_apktool_yml(
     versionName: str, versionCode: int, minSdkVersion: int, targetSdkVersion: int
 ) -> None:
+    import yaml
+
     data = None
     apktool_yml_path = f"{config['folders']['decompiled']}/apktool.yml"
 
@@ -150,85 +210,123 @@ def save_apktool_yml(
         }
     )
 
+    detach_file(apktool_yml_path)
     with open(apktool_yml_path, "w", encoding="utf-8") as f:
         yaml.dump(data, f, indent=2, Dumper=yaml.Dumper)
 
 
+class XmlEditSession:
+    def __init__(self):
+        from lxml import etree
+
+        self.parser = etree.XMLParser(remove_blank_text=True)
+        self.trees: dict[str, "etree._ElementTree"] = {}
+        self.dirty: dict[str, None] = {}
+
+    def __enter__(self) -> "XmlEditSession":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # a failed patch must not leave half of its edits on disk
+        if exc_type is None:
+            self.flush()
+
+    def tree(self, file_path: str) -> "etree._ElementTree":
+        file_path = os.path.abspath(file_path)
+        tree = self.trees.get(file_path)
+        if tree is None:
+            from lxml import etree
+
+            tree = etree.parse(file_path, self.parser)
+            self.trees[file_path] = tree
+        return tree
+
+    def root(self, file_path: str) -> "etree._Element":
+        return self.tree(file_path).getroot()
+
+    def mark_dirty(self, file_path: str) -> None:
+        self.dirty[os.path.abspath(file_path)] = None
+
+    def flush(self) -> None:
+        for file_path in self.dirty:
+            detach_file(file_path)
+            self.trees[file_path].write(
+                file_path,
+                pretty_print=True,
+                xml_declaration=True,
+                encoding="utf-8",
+            )
+        self.dirty.clear()
+
+    def change_colors(self, values: dict[str, str], mode: str = "") -> None:
+        file_path = f"{config['folders']['decompiled']}/res/values{mode}/colors.xml"
+        root = self.root(file_path)
+        for value in values.items():
+            root.find(f".//color[@name='{value[0]}']").text = value[1]
+        self.mark_dirty(file_path)
+
+    def change_attributes(
+        self, file_path: str, values: dict[str, str], xpath=".//*"
+    ) -> None:
+        root = self.root(file_path)
+        for value in values.items():
+            root.find(f"{xpath}[@{value[0]}]").set(value[0], value[1])
+        self.mark_dirty(file_path)
+
+    def change_attributes_all(
+        self, file_path: str, values: dict[str, str], xpath=".//*"
+    ) -> None:
+        root = self.root(file_path)
+        for value in values.items():
+            for el in root.findall(f"{xpath}[@{value[0]}]"):
+                el.set(value[0], value[1])
+        self.mark_dirty(file_path)
+
+    def change_attributes_with_value(
+        self, file_path: str, values: dict[str, str], search_value: str, xpath=".//*"
+    ) -> None:
+        root = self.root(file_path)
+        for value in values.items():
+            root.find(f"{xpath}[@{value[0]}='{search_value}']").set(value[0], value[1])
+        self.mark_dirty(file_path)
+
+    def change_attributes_all_with_value(
+        self, file_path: str, values: dict[str, str], search_value: str, xpath=".//*"
+    ) -> None:
+        root = self.root(file_path)
+        for value in values.items():
+            for el in root.findall(f"{xpath}[@{value[0]}='{search_value}']"):
+                el.set(value[0], value[1])
+        self.mark_dirty(file_path)
+
+
 def change_colors(values: dict[str, str], mode: str = "") -> None:
-    file_path = f"{config['folders']['decompiled']}/res/values{mode}/colors.xml"
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(file_path, parser)
-    root = tree.getroot()
-    for value in values.items():
-        root.find(f".//color[@name='{value[0]}']").text = value[1]
-    tree.write(
-        file_path,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
+    with XmlEditSession() as session:
+        session.change_colors(values, mode)
 
 
 def change_attributes(file_path: str, values: dict[str, str], xpath=".//*") -> None:
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(file_path, parser)
-    root = tree.getroot()
-    for value in values.items():
-        root.find(f"{xpath}[@{value[0]}]").set(value[0], value[1])
-    tree.write(
-        file_path,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
+    with XmlEditSession() as session:
+        session.change_attributes(file_path, values, xpath)
 
 
 def change_attributes_all(file_path: str, values: dict[str, str], xpath=".//*") -> None:
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(file_path, parser)
-    root = tree.getroot()
-    for value in values.items():
-        for el in root.findall(f"{xpath}[@{value[0]}]"):
-            el.set(value[0], value[1])
-    tree.write(
-        file_path,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
+    with XmlEditSession() as session:
+        session.change_attributes_all(file_path, values, xpath)
 
 
 def change_attributes_with_value(
     file_path: str, values: dict[str, str], search_value: str, xpath=".//*"
 ) -> None:
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(file_path, parser)
-    root = tree.getroot()
-    for value in values.items():
-        root.find(f"{xpath}[@{value[0]}='{search_value}']").set(value[0], value[1])
-    tree.write(
-        file_path,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
+    with XmlEditSession() as session:
+        session.change_attributes_with_value(file_path, values, search_value, xpath)
 
 
 def change_attributes_all_with_value(
     file_path: str, values: dict[str, str], search_value: str, xpath=".//*"
 ) -> None:
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.parse(file_path, parser)
-    root = tree.getroot()
-    for value in values.items():
-        for el in root.findall(f"{xpath}[@{value[0]}='{search_value}']"):
-            el.set(value[0], value[1])
-    tree.write(
-        file_path,
-        pretty_print=True,
-        xml_declaration=True,
-        encoding="utf-8",
-    )
+    with XmlEditSession() as session:
+        session.change_attributes_all_with_value(file_path, values, search_value, xpath)
 
 
 def hex_to_lottie(hex_color: str) -> tuple[float, float, float]:
@@ -0,0 +1,187 @@
+import filecmp
+import json
+import os
+import shutil
+import stat
+
+FICLONE = 0x40049409
+WORKTREE_MARKER = ".worktree"
+WORKTREE_MODES = ["hardlink", "reflink", "copy"]
+reflink_supported = os.name == "posix"
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def clone_file(src: str, dst: str) -> None:
+    global reflink_supported
+    if reflink_supported:
+        try:
+            import fcntl
+
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            shutil.copystat(src, dst)
+            return
+        except (ImportError, OSError):
+            reflink_supported = False
+    shutil.copy2(src, dst)
+
+
+def link_file(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        clone_file(src, dst)
+        return
+    # the inode is shared with the pristine tree, a write that skips
+    # detach_file has to fail instead of poisoning the cache
+    mode = os.stat(src).st_mode
+    if mode & WRITE_BITS:
+        os.chmod(src, mode & ~WRITE_BITS)
+
+
+def remove_tree(path: str) -> None:
+    # hardlink mode leaves read-only files behind, windows refuses to delete those
+    def make_writable(function, failed_path, exc) -> None:
+        os.chmod(failed_path, os.stat(failed_path).st_mode | stat.S_IWUSR)
+        function(failed_path)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path, onexc=make_writable)
+
+
+def copy_function(mode: str):
+    if mode == "hardlink":
+        return link_file
+    if mode == "reflink":
+        return clone_file
+    return shutil.copy2
+
+
+# copy-on-first-write: every helper that rewrites a file in the working tree
+# calls this first, so a hardlinked file never writes through to the pristine tree
+def detach_file(path: str) -> None:
+    try:
+        if os.stat(path).st_nlink <= 1:
+            return
+    except FileNotFoundError:
+        return
+    tmp_path = f"{path}.detach"
+    shutil.copy2(path, tmp_path)
+    # the private copy is ours to write, even if the shared file was read-only
+    os.chmod(tmp_path, os.stat(tmp_path).st_mode | stat.S_IWUSR)
+    os.replace(tmp_path, path)
+
+
+def read_worktree_marker(work: str) -> dict | None:
+    try:
+        with open(os.path.join(work, WORKTREE_MARKER), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_worktree_marker(work: str, pristine: str, mode: str) -> None:
+    with open(os.path.join(work, WORKTREE_MARKER), "w", encoding="utf-8") as file:
+        json.dump({"pristine": os.path.abspath(pristine), "mode": mode}, file)
+
+
+def is_same_file(a: os.stat_result, b: os.stat_result) -> bool:
+    return a.st_ino == b.st_ino and a.st_dev == b.st_dev
+
+
+def modified_files(
+    pristine: str, work: str, ignore: tuple[str, ...] = ()
+) -> list[str]:
+    modified = []
+    ignore = (*ignore, WORKTREE_MARKER)
+    for dirpath, dirnames, filenames in os.walk(work):
+        relpath = os.path.relpath(dirpath, work)
+        if relpath == ".":
+            dirnames[:] = [name for name in dirnames if name not in ignore]
+            relpath = ""
+        for name in filenames:
+            path = os.path.join(relpath, name)
+            if path in ignore:
+                continue
+            source = os.path.join(pristine, path)
+            try:
+                source_stat = os.stat(source)
+            except FileNotFoundError:
+                modified.append(path)
+                continue
+            path_stat = os.stat(os.path.join(work, path))
+            if is_same_file(source_stat, path_stat):
+                continue
+            if (
+                path_stat.st_size == source_stat.st_size
+                and path_stat.st_mtime_ns == source_stat.st_mtime_ns
+            ):
+                continue
+            if not filecmp.cmp(source, os.path.join(work, path), shallow=False):
+                modified.append(path)
+
+    for dirpath, _, filenames in os.walk(pristine):
+        relpath = os.path.relpath(dirpath, pristine)
+        relpath = "" if relpath == "." else relpath
+        for name in filenames:
+            path = os.path.join(relpath, name)
+            if not os.path.lexists(os.path.join(work, path)):
+                modified.append(path)
+    return modified
+
+
+def reset_worktree(pristine: str, work: str, mode: str) -> None:
+    link = copy_function(mode)
+    for dirpath, dirnames, filenames in os.walk(work):
+        relpath = os.path.relpath(dirpath, work)
+        pristine_dir = os.path.normpath(os.path.join(pristine, relpath))
+        for name in list(dirnames):
+            if not os.path.isdir(os.path.join(pristine_dir, name)):
+                remove_tree(os.path.join(dirpath, name))
+                dirnames.remove(name)
+        for name in filenames:
+            if relpath == "." and name == WORKTREE_MARKER:
+                continue
+            path = os.path.join(dirpath, name)
+            source = os.path.join(pristine_dir, name)
+            try:
+                source_stat = os.stat(source)
+            except FileNotFoundError:
+                os.remove(path)
+                continue
+            path_stat = os.stat(path)
+            if mode == "hardlink" and is_same_file(source_stat, path_stat):
+                continue
+            if (
+                mode != "hardlink"
+                and path_stat.st_size == source_stat.st_size
+                and path_stat.st_mtime_ns == source_stat.st_mtime_ns
+            ):
+                continue
+            os.remove(path)
+            link(source, path)
+
+    # files the run deleted from the working tree
+    for dirpath, _, filenames in os.walk(pristine):
+        work_dir = os.path.normpath(
+            os.path.join(work, os.path.relpath(dirpath, pristine))
+        )
+        os.makedirs(work_dir, exist_ok=True)
+        for name in filenames:
+            if not os.path.lexists(os.path.join(work_dir, name)):
+                link(os.path.join(dirpath, name), os.path.join(work_dir, name))
+
+
+def checkout_worktree(pristine: str, work: str, mode: str = "reflink") -> None:
+    marker = read_worktree_marker(work)
+    if (
+        marker is not None
+        and marker["pristine"] == os.path.abspath(pristine)
+        and marker["mode"] == mode
+    ):
+        reset_worktree(pristine, work, mode)
+        return
+
+    remove_tree(work)
+    shutil.copytree(pristine, work, symlinks=True, copy_function=copy_function(mode))
+    write_worktree_marker(work, pristine, mode)